@@ -39,11 +39,12 @@ import atexit
 from PyQt4 import QtCore, QtGui  # @UnresolvedImport
 
 from opengnsys import VERSION, ipc, operations, utils
-from opengnsys.log import logger
+from opengnsys.log import logger, LOG_MAXSIZE, LOG_BACKUPS
 from opengnsys.service import IPC_PORT
 from about_dialog_ui import Ui_OGAAboutDialog
 from message_dialog_ui import Ui_OGAMessageDialog
 from opengnsys.scriptThread import ScriptExecutorThread
+from opengnsys.idle import IdleMonitor
 from opengnsys.config import readConfig
 from opengnsys.loader import loadModules
 
@@ -167,6 +168,8 @@ class OGASystemTray(QtGui.QSystemTrayIcon):
 
         # Set up log level
         logger.setLevel(cfg.get('log', 'INFO'))
+        logger.setRotation(cfg.get('log_maxsize', LOG_MAXSIZE), cfg.get('log_maxage'),
+                           cfg.get('log_backups', LOG_BACKUPS))
 
         self.ipcport = int(cfg.get('ipc_port', IPC_PORT))
 
@@ -184,9 +187,6 @@ class OGASystemTray(QtGui.QSystemTrayIcon):
         if self.ipc.isAlive() is False:
             raise Exception('No connection to service, exiting.')
 
-        self.timer = QtCore.QTimer()
-        self.timer.timeout.connect(self.timerFnc)
-
         self.stopped = False
 
         self.ipc.message.connect(self.message)
@@ -197,7 +197,7 @@ class OGASystemTray(QtGui.QSystemTrayIcon):
         self.aboutDlg = OGAAboutDialog()
         self.msgDlg = OGAMessageDialog()
 
-        self.timer.start(1000)  # Launch idle checking every 1 seconds
+        self.idleMonitor = IdleMonitor()
 
         self.ipc.start()
 
@@ -220,6 +220,13 @@ class OGASystemTray(QtGui.QSystemTrayIcon):
 
         self.modules[:] = validMods  # copy instead of assignment
 
+        # Idle time is only sampled if any module is interested on it
+        for mod in self.modules:
+            for threshold in mod.idleThresholds:
+                self.idleMonitor.watch(threshold, mod.onIdle, mod.onActive)
+        if self.idleMonitor.watches:
+            self.idleMonitor.start()
+
         # If this is running, it's because he have logged in, inform service of this fact
         self.ipc.sendLogin((operations.getCurrentUser(), operations.getSessionLanguage(),
                             operations.get_session_type()))
@@ -233,9 +240,6 @@ class OGASystemTray(QtGui.QSystemTrayIcon):
                 logger.exception()
                 logger.error("Deactivation of {} failed: {}".format(mod.name, utils.exceptionToMessage(e)))
 
-    def timerFnc(self):
-        pass
-
     def message(self, msg):
         """
         Processes the message sent asynchronously, msg is an QString
@@ -275,6 +279,7 @@ class OGASystemTray(QtGui.QSystemTrayIcon):
         logger.debug('Quit invoked')
         if self.stopped is False:
             self.stopped = True
+            self.idleMonitor.stop()
             try:
                 self.deinitialize()
             except Exception:
@@ -285,7 +290,6 @@ class OGASystemTray(QtGui.QSystemTrayIcon):
                 # If we close Client, send Logoff to Broker
                 self.ipc.sendLogout(operations.getCurrentUser())
                 time.sleep(1)
-                self.timer.stop()
                 self.ipc.stop()
             except Exception:
                 # May we have lost connection with server, simply log and exit in that case
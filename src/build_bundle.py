@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Builds a single file bundle of the agent (a zip application), with precompiled bytecode and an index of the modules
+of every package, so agent can be run from NFS or a ramdisk without scanning opengnsys packages nor looking for .pyc
+files on every import:
+    python build_bundle.py [-o ogagent.pyz] [--sources]
+Bytecode is only valid for the Python version running this script, so run it with the one used by clients.
+Bundle runs Linux service, accepting its same arguments:
+    python ogagent.pyz start|stop|restart|fg|login|logout|message ...
+"""
+from __future__ import unicode_literals, print_function
+
+import argparse
+import imp
+import json
+import marshal
+import os
+import struct
+import sys
+import time
+import zipfile
+
+PACKAGE = 'opengnsys'
+EXCLUDED = ('opengnsys/windows', 'opengnsys/macos')  # Not used on Linux clients
+OUTPUT = 'ogagent.pyz'
+INDEX = 'index.json'  # Must match opengnsys.bundle.INDEX
+
+MAIN = b'''# -*- coding: utf-8 -*-
+# Bundle entry point, runs agent service
+import os
+import sys
+# Bundle path must be absolute, as daemon changes its working directory and modules are imported later
+sys.path[0] = os.path.abspath(sys.path[0])
+from opengnsys.linux.OGAgentService import main
+main()
+'''
+
+
+def isPackage(path):
+    return os.path.isfile(os.path.join(path, '__init__.py'))
+
+
+def findSources(root):
+    """
+    Returns paths (with / as separator) of source files of root package, and the index of modules of every package
+    """
+    sources = []
+    index = {}
+    for dirPath, dirNames, fileNames in os.walk(root):
+        dirPath = dirPath.replace(os.sep, '/')
+        dirNames[:] = sorted(d for d in dirNames
+                             if '{}/{}'.format(dirPath, d) not in EXCLUDED and isPackage(os.path.join(dirPath, d)))
+        modules = [[d, True] for d in dirNames]
+        for fileName in sorted(fileNames):
+            if fileName.endswith('.py'):
+                sources.append('{}/{}'.format(dirPath, fileName))
+                if fileName != '__init__.py':
+                    modules.append([fileName[:-3], False])
+        index[dirPath.replace('/', '.')] = sorted(modules)
+    return sources, index
+
+
+def zipInfo(name, mtime):
+    # Zip entries times have a resolution of 2 seconds
+    dateTime = time.localtime(mtime)[:5] + (time.localtime(mtime)[5] // 2 * 2,)
+    info = zipfile.ZipInfo(name, dateTime)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def compileSource(path, mtime):
+    """
+    Returns .pyc contents for source file, as written by py_compile
+    mtime must be the one of the zip entry of the source (if included), or zipimport will not trust bytecode
+    """
+    with open(path, 'rb') as f:
+        source = f.read()
+    code = compile(source, path, 'exec', 0, True)
+    return imp.get_magic() + struct.pack(str('<I'), int(mtime)) + marshal.dumps(code)
+
+
+def build(output, includeSources=False):
+    sources, index = findSources(PACKAGE)
+    tmpOutput = output + '.tmp'
+    with open(tmpOutput, 'wb') as f:
+        f.write(b'#!/usr/bin/env python2\n')
+        with zipfile.ZipFile(f, 'w') as bundle:
+            for path in sources:
+                sourceInfo = zipInfo(path, os.path.getmtime(path))
+                mtime = time.mktime(sourceInfo.date_time + (0, 0, -1))
+                bundle.writestr(zipInfo(path + 'c', mtime), compileSource(path, mtime))
+                if includeSources:
+                    with open(path, 'rb') as source:
+                        bundle.writestr(sourceInfo, source.read())
+            bundle.writestr(zipInfo(INDEX, time.time()), json.dumps(index, sort_keys=True).encode('utf-8'))
+            bundle.writestr(zipInfo('__main__.py', time.time()), MAIN)
+    os.chmod(tmpOutput, 0o755)
+    os.rename(tmpOutput, output)
+    return len(sources), len(index)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds a single file bundle of OpenGnsys Agent')
+    parser.add_argument('-o', '--output', default=OUTPUT, help='Bundle file (default: %(default)s)')
+    parser.add_argument('--sources', action='store_true',
+                        help='Include also source files (larger bundle, source lines on tracebacks)')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    # Paths inside bundle are relative to this folder
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    modules, packages = build(output, args.sources)
+    print('{}: {} modules of {} packages, compiled for Python {}, {} bytes'.format(
+        output, modules, packages, '.'.join(str(v) for v in sys.version_info[:3]), os.path.getsize(output)))
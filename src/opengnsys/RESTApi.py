@@ -37,14 +37,31 @@ from __future__ import unicode_literals
 import requests
 import logging
 import json
+import threading
+import time
 import warnings
+import six
 
 from .log import logger
+from .tracing import Tracer, TracingAdapter
 
 from .utils import exceptionToMessage
 
 VERIFY_CERT = False  # Do not check server certificate
-TIMEOUT = 5  # Connection timout, in seconds
+TIMEOUT = 5  # Connection timout, in seconds, until response times of a server are known
+MIN_TIMEOUT = 2  # Bounds of adaptive timeouts, in seconds
+MAX_TIMEOUT = 20
+MAX_BACKOFF = 8  # Maximum multiplier of adaptive timeouts, after consecutive timeouts
+RTT_WEIGHT = 0.125  # Weight of last response time on its moving average (as TCP retransmission timer, RFC 6298)
+RTTVAR_WEIGHT = 0.25  # Weight of last response time deviation on its moving average
+BREAKER_THRESHOLD = 3  # Consecutive failures that opens the circuit breaker of an endpoint
+BREAKER_COOLDOWN = 30  # Seconds before an open circuit lets a trial request pass
+UNSUPPORTED_STATUS = (404, 405, 501)  # HTTP status codes meaning that server does not implement a method
+POOL_SIZE = 4  # Kept alive connections to server
+HEALTH_WEIGHT = 0.3  # Weight of last request on endpoints health (exponentially weighted moving average)
+PREFERENCE_BIAS = 0.05  # Health penalty for every position on endpoints list, so preferred ones win on ties
+PROBE_INTERVAL = 15  # Seconds between probes to failed endpoints
+RECOVERED_SCORE = 0.99  # Endpoints are probed until their score reaches this value
 
 
 class RESTError(Exception):
@@ -55,6 +72,111 @@ class ConnectionError(RESTError):
     ERRCODE = -1
 
 
+class RESTTimeoutError(ConnectionError):
+    pass
+
+
+class InvalidResponseError(ConnectionError):
+    """
+    Server has answered, but its response can't be decoded
+    """
+    pass
+
+
+class RejectedError(RESTError):
+    """
+    Server is reachable, but has refused the request (HTTP 4xx status), so sending it again will not help
+    """
+    ERRCODE = -3
+
+
+class UnsupportedError(RejectedError):
+    """
+    Server is reachable, but does not implement the requested method
+    """
+    ERRCODE = -2
+
+
+class Endpoint(object):
+    """
+    A REST server base url, with its rolling health, adaptive timeout and circuit breaker
+    Circuit breaker is "closed" (requests pass) until BREAKER_THRESHOLD consecutive failures, then it is "open"
+    (requests are rejected without waiting for the server) for BREAKER_COOLDOWN seconds, and then "half open": just one
+    trial request passes, closing the circuit on success or opening it again on failure.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half open'
+
+    def __init__(self, url, index):
+        self.url = url if url[-1] == '/' else url + '/'
+        self.index = index  # Position on preference list
+        self.score = 1.0  # Moving average of results (1 success, 0 failure)
+        self.latency = None  # Moving average of response time (smoothed rtt), in seconds
+        self.deviation = None  # Moving average of response time deviation
+        self.backoff = 1  # Timeout multiplier, doubled on every timeout
+        self.failed = False  # Last request to this endpoint has failed
+        self.failures = 0  # Consecutive failures
+        self.state = Endpoint.CLOSED
+        self.openedAt = 0
+
+    def record(self, success, elapsed=None, timedOut=False):
+        self.score += HEALTH_WEIGHT * ((1.0 if success else 0.0) - self.score)
+        if elapsed is not None:
+            if self.latency is None:
+                self.latency, self.deviation = elapsed, elapsed / 2.0
+            else:
+                self.deviation += RTTVAR_WEIGHT * (abs(self.latency - elapsed) - self.deviation)
+                self.latency += RTT_WEIGHT * (elapsed - self.latency)
+        self.failed = not success
+        if success:
+            self.failures, self.backoff = 0, 1
+            self.state = Endpoint.CLOSED
+        else:
+            self.failures += 1
+            if timedOut:
+                self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+            if self.state == Endpoint.HALF_OPEN or self.failures >= BREAKER_THRESHOLD:
+                self.state, self.openedAt = Endpoint.OPEN, time.time()
+
+    def allow(self):
+        """
+        Returns True if a request can be sent to this endpoint, according to its circuit breaker
+        """
+        now = time.time()
+        if self.state == Endpoint.OPEN and now - self.openedAt >= BREAKER_COOLDOWN or \
+                self.state == Endpoint.HALF_OPEN and now - self.openedAt >= MAX_TIMEOUT:  # Trial result was lost
+            self.state, self.openedAt = Endpoint.HALF_OPEN, now
+            return True  # Trial request
+        return self.state == Endpoint.CLOSED
+
+    def timeout(self):
+        """
+        Returns the timeout for next request, based on response times (smoothed rtt + 4 times its deviation)
+        Timeouts are doubled after every timed out request (up to MAX_BACKOFF times), in case response times have
+        grown since last sample.
+        """
+        if self.latency is None:
+            return TIMEOUT
+        return min(max((self.latency + 4 * self.deviation) * self.backoff, MIN_TIMEOUT), MAX_TIMEOUT)
+
+    def recovering(self):
+        return self.score < RECOVERED_SCORE
+
+    def health(self, defaultLatency=0.0):
+        """
+        Returns endpoint health. Not yet measured latency is considered to be defaultLatency
+        """
+        latency = self.latency if self.latency is not None else defaultLatency
+        return self.score / (1.0 + latency) - PREFERENCE_BIAS * self.index
+
+    def asDict(self):
+        return {'url': self.url, 'score': self.score, 'latency': self.latency, 'timeout': self.timeout(),
+                'state': self.state}
+
+    def __str__(self):
+        return '{} (score: {:.2f}, latency: {}, timeout: {:.2f}, {})'.format(self.url, self.score, self.latency,
+                                                                            self.timeout(), self.state)
+
+
 # Disable warnings log messages
 try:
     import urllib3  # @UnusedImport
@@ -82,18 +204,29 @@ class REST(object):
          This will generate a POST message to https://example.com/rest/v1/hello?param1=1&param2=2, with json encoded
          body {'name': 'mario' }, and also returns
          the deserialized JSON result or raises an exception in case of error 
+    Connections are kept alive and pooled, and can be safely shared among threads.
+    Times of last requests (name resolution, connection, TLS handshake, first byte and total) are kept on
+    tracer.
+    Several (equivalent) servers can be provided, in order of preference:
+       v = REST(['https://example.com/rest/v1/', 'https://backup.example.com/rest/v1/'])
+         Every request is sent to the healthiest server (based on recent results and response times), failing over
+         to the others if it can't be reached. Failed servers are probed in background, so they are used again
+         as soon as they recover.
     """
 
-    def __init__(self, url):
+    def __init__(self, url, poolSize=POOL_SIZE):
         """
         Initializes the REST helper
         url is the full url of the REST API Base, as for example "https://example.com/rest/v1".
-        @param url The url of the REST API Base. The trailing '/' can be included or omitted, as desired.
+        @param url The url of the REST API Base (or a list of them). The trailing '/' can be included or omitted.
+        @param poolSize Maximum number of connections kept alive to every server
         """
-        self.endpoint = url
-
-        if self.endpoint[-1] != '/':
-            self.endpoint += '/'
+        if isinstance(url, six.string_types):
+            url = [url]
+        self.endpoints = [Endpoint(u, i) for i, u in enumerate(url)]
+        self.endpoint = self.endpoints[0].url
+        self.healthLock = threading.Lock()
+        self.prober = None
 
         # Some OSs ships very old python requests lib implementations, workaround them...
         try:
@@ -101,6 +234,11 @@ class REST(object):
         except Exception:
             self.newerRequestLib = False  # I no version, guess this must be an old requests
 
+        self.session = None
+        self.sessionLock = threading.Lock()
+        self.poolSize = poolSize
+        self.tracer = Tracer()
+
         # Disable logging requests messages except for errors, ...
         logging.getLogger("requests").setLevel(logging.CRITICAL)
         # Tries to disable all warnings
@@ -109,59 +247,190 @@ class REST(object):
         except Exception:
             pass
 
-    def _getUrl(self, method):
+    def _getSession(self):
+        """
+        Internal method
+        Returns the connection pooled session, creating it on first use
+        Old requests lib versions does not support adapters, so they will use a new connection on every request
+        """
+        if self.session is None and self.newerRequestLib:
+            with self.sessionLock:
+                if self.session is None:
+                    session = requests.Session()
+                    adapter = (TracingAdapter or requests.adapters.HTTPAdapter)(
+                        pool_connections=len(self.endpoints), pool_maxsize=self.poolSize)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self.session = session
+        return self.session if self.session is not None else requests
+
+    def close(self):
+        """
+        Closes pooled connections
+        """
+        with self.sessionLock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+    def _getUrl(self, method, endpoint=None):
         """
         Internal method
         Composes the URL based on "method"
         @param method: Method to append to base url for composition 
+        @param endpoint: Server to use, preferred one if omitted
         """
-        url = self.endpoint + method
+        url = (endpoint or self.endpoints[0]).url + method
 
         return url
 
-    def _request(self, url, data=None):
+    def getEndpoints(self):
+        """
+        Returns servers, healthiest first
+        Servers not used yet are considered as slow as the slowest known one, so they are not preferred just because
+        of that.
+        """
+        with self.healthLock:
+            latency = max([e.latency for e in self.endpoints if e.latency is not None] or [0.0])
+            return sorted(self.endpoints, key=lambda e: -e.health(latency))
+
+    def _allow(self, endpoint):
+        """
+        Internal method
+        Checks the circuit breaker of an endpoint
+        """
+        with self.healthLock:
+            return endpoint.allow()
+
+    def _record(self, endpoint, success, elapsed=None, timedOut=False):
+        """
+        Internal method
+        Updates health of an endpoint, launching the prober if needed
+        """
+        with self.healthLock:
+            state = endpoint.state
+            endpoint.record(success, elapsed, timedOut)
+            if endpoint.state != state:
+                logger.debug('Circuit breaker of server {} is now {}'.format(endpoint.url, endpoint.state))
+            if endpoint.failed and len(self.endpoints) > 1 and self.prober is None:
+                self.prober = threading.Thread(target=self._probe)
+                self.prober.daemon = True
+                self.prober.start()
+
+    def _probe(self):
+        """
+        Internal method
+        Checks failed servers until all of them are fully healthy again, so they are used again (in order of
+        preference) once recovered. Any HTTP response is considered a success, and closes the circuit breaker.
+        """
+        while True:
+            time.sleep(PROBE_INTERVAL)
+            with self.healthLock:
+                recovering = [e for e in self.endpoints if e.recovering()]
+                if not recovering:
+                    self.prober = None
+                    return
+            for endpoint in recovering:
+                start = time.time()
+                try:
+                    if self.newerRequestLib:
+                        self._getSession().get(endpoint.url, verify=VERIFY_CERT, timeout=endpoint.timeout())
+                    else:
+                        self._getSession().get(endpoint.url)
+                    if endpoint.failed:
+                        logger.debug('Server {} is reachable again'.format(endpoint))
+                    self._record(endpoint, True, time.time() - start)
+                except requests.exceptions.Timeout:
+                    self._record(endpoint, False, timedOut=True)
+                except Exception:
+                    self._record(endpoint, False)
+
+    def _request(self, url, data=None, timeout=TIMEOUT):
         """
         Launches the request
         @param url: The url to obtain
         @param data: if None, the request will be sent as a GET request. If != None, the request will be sent as a POST,
         with data serialized as JSON in the body.
+        @param timeout: Seconds to wait for the server
         """
+        session = self._getSession()
+        trace = self.tracer.begin('GET' if data is None else 'POST', url)
+        status = error = None
         try:
             if data is None:
                 logger.debug('Requesting using GET (no data provided) {}'.format(url))
                 # Old requests version does not support verify, but it do not checks ssl certificate by default
                 if self.newerRequestLib:
-                    r = requests.get(url, verify=VERIFY_CERT, timeout=TIMEOUT)
+                    r = session.get(url, verify=VERIFY_CERT, timeout=timeout)
                 else:
-                    r = requests.get(url)
+                    r = session.get(url)
             else:  # POST
                 logger.debug('Requesting using POST {}, data: {}'.format(url, data))
                 if self.newerRequestLib:
-                    r = requests.post(url, data=data, headers={'content-type': 'application/json'},
-                                      verify=VERIFY_CERT, timeout=TIMEOUT)
+                    r = session.post(url, data=data, headers={'content-type': 'application/json'},
+                                     verify=VERIFY_CERT, timeout=timeout)
                 else:
-                    r = requests.post(url, data=data, headers={'content-type': 'application/json'})
+                    r = session.post(url, data=data, headers={'content-type': 'application/json'})
 
-            r = json.loads(r.content)  # Using instead of r.json() to make compatible with old requests lib versions
+            status = r.status_code
+            if r.status_code in UNSUPPORTED_STATUS:
+                raise UnsupportedError('Method not supported by server (HTTP status {})'.format(r.status_code))
+            if 400 <= r.status_code < 500:
+                raise RejectedError('Request rejected by server (HTTP status {})'.format(r.status_code))
+            try:
+                r = json.loads(r.content)  # Using instead of r.json() to make compatible with old requests lib versions
+            except ValueError as e:
+                raise InvalidResponseError('Invalid response from server (HTTP status {}): {}'.format(
+                    status, exceptionToMessage(e)))
+        except RESTError as e:
+            error = exceptionToMessage(e)
+            raise
+        except requests.exceptions.Timeout as e:
+            error = exceptionToMessage(e)
+            raise RESTTimeoutError(e)
         except requests.exceptions.RequestException as e:
+            error = exceptionToMessage(e)
             raise ConnectionError(e)
         except Exception as e:
-            raise ConnectionError(exceptionToMessage(e))
+            error = exceptionToMessage(e)
+            raise ConnectionError(error)
+        finally:
+            self.tracer.end(trace, status, error)
 
         return r
 
-    def sendMessage(self, msg, data=None, processData=True):
+    def sendMessage(self, msg, data=None, processData=True, endpoint=None):
         """
         Sends a message to remote REST server
         @param data: if None or omitted, message will be a GET, else it will send a POST
         @param processData: if True, data will be serialized to json before sending, else, data will be sent as "raw" 
+        @param endpoint: if provided, message is sent just to this server, else healthiest ones are tried in turn
+        Servers with an open circuit breaker are skipped, so if none of them is available, ConnectionError is raised
+        without waiting.
         """
         logger.debug('Invoking post message {} with data {}'.format(msg, data))
 
         if processData and data is not None:
             data = json.dumps(data)
 
-        url = self._getUrl(msg)
-        logger.debug('Requesting {}'.format(url))
+        error = ConnectionError('No server available (circuit breakers open)')
+        for e in ([endpoint] if endpoint is not None else self.getEndpoints()):
+            if not self._allow(e):
+                continue
+            url = self._getUrl(msg, e)
+            logger.debug('Requesting {}'.format(url))
+            start = time.time()
+            try:
+                r = self._request(url, data, e.timeout())
+            except ConnectionError as err:
+                error = err
+                self._record(e, False, timedOut=isinstance(err, RESTTimeoutError))
+                logger.debug('Server {} failed: {}'.format(e, exceptionToMessage(err)))
+                continue
+            except RESTError:
+                self._record(e, True, time.time() - start)  # Server is fine, although it can't process this request
+                raise
+            self._record(e, True, time.time() - start)
+            return r
 
-        return self._request(url, data)
+        raise error
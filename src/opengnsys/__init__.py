@@ -31,6 +31,10 @@
 """
 from __future__ import unicode_literals
 
+import time
+
+STARTED_AT = time.time()  # Used to report time spent importing agent
+
 # On centos, old six release does not includes byte2int, nor six.PY2
 import six
 
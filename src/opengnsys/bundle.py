@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Support for running agent from a single file bundle (see build_bundle.py), where packages are not scanned for modules
+but listed in an index embedded in the bundle
+"""
+from __future__ import unicode_literals
+
+import json
+import pkgutil
+import sys
+
+INDEX = 'index.json'  # Module index, at bundle root
+
+_index = None
+
+
+def getBundle():
+    """
+    Returns path of bundle agent is running from, or None if it is running from sources
+    """
+    return getattr(globals().get('__loader__'), 'archive', None)
+
+
+def _getIndex():
+    global _index
+    if _index is None:
+        _index = json.loads(__loader__.get_data(INDEX).decode('utf-8'))
+    return _index
+
+
+def listModules(package):
+    """
+    Returns (name, isPackage) of modules contained in a package (given by name), as pkgutil.iter_modules
+    """
+    if getBundle() is not None:
+        return [tuple(v) for v in _getIndex().get(package, ())]
+    return [(name, ispkg) for _, name, ispkg in pkgutil.iter_modules(sys.modules[package].__path__)]
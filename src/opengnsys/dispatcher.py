@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Dispatches events (login, logout, client messages...) to modules, each module on its own thread and queue, so a slow
+module does not delay other modules nor the thread notifying the event
+"""
+from __future__ import unicode_literals
+
+import threading
+import time
+
+import six
+
+from .log import logger
+
+QUEUE_SIZE = 1000  # Maximum number of events waiting to be processed by a module, newer ones are dropped
+STOP_TIMEOUT = 5  # Maximum time, in seconds, waiting for pending events to be processed on stop
+
+
+class ModuleQueue(threading.Thread):
+    """
+    Invokes module event handlers, in the same order as they were dispatched
+    """
+    def __init__(self, name):
+        super(ModuleQueue, self).__init__(name='Events-{}'.format(name))
+        self.daemon = True
+        self.moduleName = name
+        self.queue = six.moves.queue.Queue(QUEUE_SIZE)  # @UndefinedVariable
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.maxDepth = 0
+        self.maxTime = 0
+        self.current = None  # (event, start time) of event being processed
+
+    def put(self, event, handler, args):
+        try:
+            self.queue.put_nowait((event, handler, args))
+        except six.moves.queue.Full:  # @UndefinedVariable
+            self.dropped += 1
+            return False
+        self.maxDepth = max(self.maxDepth, self.queue.qsize())
+        return True
+
+    def stop(self):
+        try:
+            self.queue.put_nowait((None, None, None))  # Pending events are processed before stopping
+        except six.moves.queue.Full:  # @UndefinedVariable
+            pass  # Thread is daemon, it will not prevent exiting
+
+    def getStats(self):
+        current = self.current
+        return {'depth': self.queue.qsize(), 'maxDepth': self.maxDepth, 'processed': self.processed,
+                'dropped': self.dropped, 'errors': self.errors, 'maxTime': self.maxTime,
+                'current': current[0] if current else None,
+                'currentTime': time.time() - current[1] if current else None}
+
+    def run(self):
+        while True:
+            event, handler, args = self.queue.get()
+            if handler is None:
+                break
+            self.current = (event, time.time())
+            try:
+                handler(*args)
+            except Exception as e:
+                self.errors += 1
+                logger.error('Got exception %s processing %s event on %s', e, event,
+                             self.moduleName)
+            self.maxTime = max(self.maxTime, time.time() - self.current[1])
+            self.processed += 1
+            self.current = None
+
+
+class EventDispatcher(object):
+    """
+    Keeps a queue (and its thread, started on first event) per module
+    Events dispatched to a module are processed in order (i.e. a login before its logout), but independently of
+    events of other modules
+    """
+    def __init__(self):
+        self.queues = {}
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def _getQueue(self, name):
+        with self.lock:
+            if self.stopped:
+                return None
+            queue = self.queues.get(name)
+            if queue is None:
+                queue = self.queues[name] = ModuleQueue(name)
+                queue.start()
+            return queue
+
+    def dispatch(self, module, event, handler, *args):
+        """
+        Queues invocation of handler(*args) on module's thread
+        """
+        queue = self._getQueue(module.name)
+        if queue is None:
+            logger.debug('Event %s not sent to %s, stopping', event, module.name)
+        elif not queue.put(event, handler, args):
+            logger.error('Too many events pending on %s, %s event dropped', module.name, event)
+
+    def getStats(self):
+        """
+        Returns queue metrics of every module: events waiting (depth and maxDepth), processed, dropped, errors,
+        maximum processing time and event being processed (with its time until now)
+        """
+        with self.lock:
+            queues = list(self.queues.values())
+        return dict((q.moduleName, q.getStats()) for q in queues)
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Stops module threads, waiting (at most timeout seconds) for pending events to be processed
+        """
+        with self.lock:
+            self.stopped = True
+            queues = list(self.queues.values())
+        for queue in queues:
+            queue.stop()
+        deadline = time.time() + timeout
+        for queue in queues:
+            queue.join(max(deadline - time.time(), 0))
+            if queue.is_alive():
+                logger.warn('Events of %s not processed in time: %s', queue.moduleName, queue.getStats())
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Cache of host facts (network interfaces, OS...), so they are not obtained again on every request
+"""
+from __future__ import unicode_literals
+
+import threading
+import time
+
+from . import operations
+
+NETWORK_TTL = 60  # Seconds network info is cached (it's also updated as soon as network watcher notifies a change)
+
+
+class HostInfo(object):
+    """
+    Keeps host facts, obtained from providers on first use and kept until their TTL expires or they are invalidated
+    Example:
+        hostInfo.get('network')  # List of network interfaces, as operations.getNetworkInfo
+        hostInfo.invalidate('network')  # Will be obtained again on next use
+        hostInfo.refresh()  # Obtains everything again, now
+    """
+    def __init__(self):
+        self.providers = {}
+        self.values = {}  # name: (value, expiration time or None)
+        self.lock = threading.Lock()
+
+    def register(self, name, provider, ttl=None):
+        """
+        Registers a fact
+        @param provider: Callable returning fact value
+        @param ttl: Seconds value is valid, None if it does not change while running
+        """
+        with self.lock:
+            self.providers[name] = (provider, ttl)
+            self.values.pop(name, None)
+
+    def set(self, name, value):
+        """
+        Stores an already known value (i.e. network info just notified by network watcher)
+        """
+        ttl = self.providers[name][1]
+        with self.lock:
+            self.values[name] = (value, time.time() + ttl if ttl is not None else None)
+
+    def get(self, name):
+        with self.lock:
+            value, expires = self.values.get(name, (None, 0))
+        if expires is not None and expires <= time.time():
+            value = self.providers[name][0]()
+            self.set(name, value)
+        return value
+
+    def invalidate(self, *names):
+        """
+        Forgets values of facts (every one if no name is provided), so they are obtained again on next use
+        """
+        with self.lock:
+            for name in names or list(self.values.keys()):
+                self.values.pop(name, None)
+
+    def refresh(self, *names):
+        """
+        Obtains again values of facts (every one if no name is provided)
+        """
+        for name in names or list(self.providers.keys()):
+            self.set(name, self.providers[name][0]())
+
+
+hostInfo = HostInfo()
+hostInfo.register('network', lambda: list(operations.getNetworkInfo()), NETWORK_TTL)
+hostInfo.register('osType', lambda: operations.os_type)
+hostInfo.register('osVersion', operations.getOsVersion)
@@ -39,27 +39,333 @@ from six.moves.BaseHTTPServer import HTTPServer  # @UnresolvedImport
 from six.moves.urllib.parse import unquote  # @UnresolvedImport
 
 import json
+import hashlib
 import threading
 import ssl
+import socket
+import struct
+import signal
+import sys
+import os
+import time
 
 from .utils import exceptionToMessage
 from .certs import createSelfSignedCert
 from .log import logger
 
+BULKHEAD_WAIT = 10  # Maximum seconds a request waits (queued) for its module or route to be available
+FORWARD_TIMEOUT = 120  # Maximum seconds a pre-forked worker waits for main process to answer a forwarded request
+WORKER_CHECK = 1  # Seconds between checks for exited pre-forked workers (so they are not respawned faster)
+
+
+class BusyError(Exception):
+    '''
+    Raised when a request is rejected because its module (or route) is processing too many requests
+    '''
+    pass
+
+
+class Bulkhead(object):
+    '''
+    Limits requests processed at once by a module (or one of its routes), so it can't use all HTTP threads.
+    Requests over the limit wait (up to maxQueued of them, at most BULKHEAD_WAIT seconds), rest are rejected
+    '''
+    def __init__(self, name, maxConcurrent, maxQueued=0):
+        self.name = name
+        self.maxConcurrent = maxConcurrent
+        self.maxQueued = maxQueued
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            if self.running >= self.maxConcurrent:
+                if self.waiting >= self.maxQueued:
+                    self.rejected += 1
+                    raise BusyError('{} is busy, try again later'.format(self.name))
+                self.waiting += 1
+                try:
+                    deadline = time.time() + BULKHEAD_WAIT
+                    while self.running >= self.maxConcurrent:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            raise BusyError('{} is busy, try again later'.format(self.name))
+                        self.condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.running += 1
+
+    def release(self):
+        with self.condition:
+            self.running -= 1
+            self.condition.notify()
+
+    def getStats(self):
+        return {'running': self.running, 'waiting': self.waiting, 'rejected': self.rejected,
+                'maxConcurrent': self.maxConcurrent, 'maxQueued': self.maxQueued}
+
+
+_bulkheads = {}
+_bulkheadsLock = threading.Lock()
+
+
+def _getBulkhead(module, route):
+    '''
+    Returns bulkhead for route of module (its own one if declared on routeLimits, the module one if not)
+    or None if there is no limit
+    '''
+    if route in module.routeLimits:
+        key, limits = '{}/{}'.format(module.name, route), module.routeLimits[route]
+    elif module.maxConcurrent is not None:
+        key, limits = module.name, (module.maxConcurrent, module.maxQueued)
+    else:
+        return None
+    with _bulkheadsLock:
+        bulkhead = _bulkheads.get(key)
+        if bulkhead is None:
+            bulkhead = _bulkheads[key] = Bulkhead(key, *limits)
+        return bulkhead
+
+
+def getBulkheadStats():
+    '''
+    Returns usage of every bulkhead (modules and routes with concurrency limits)
+    '''
+    with _bulkheadsLock:
+        bulkheads = list(_bulkheads.values())
+    return dict((b.name, b.getStats()) for b in bulkheads)
+
+
+def processModuleMessage(module, path, getParams, postParams, handler):
+    '''
+    Invokes module processServerMessage, within module (or route) concurrency limits
+    '''
+    bulkhead = _getBulkhead(module, path[0] if path else None)
+    if bulkhead is None:
+        return module.processServerMessage(path, getParams, postParams, handler)
+    bulkhead.acquire()
+    try:
+        return module.processServerMessage(path, getParams, postParams, handler)
+    finally:
+        bulkhead.release()
+
+
+def _recvAll(sock, length):
+    data = b''
+    while len(data) < length:
+        buf = sock.recv(length - len(data))
+        if buf == b'':
+            return None
+        data += buf
+    return data
+
+
+def _sendFrame(sock, obj):
+    '''
+    Sends a length prefixed json frame through a worker channel
+    '''
+    data = json.dumps(obj).encode('utf-8')
+    sock.sendall(struct.pack(str('!I'), len(data)) + data)
+
+
+def _recvFrame(sock):
+    '''
+    Receives a length prefixed json frame from a worker channel, or None if the other end has gone away
+    '''
+    header = _recvAll(sock, 4)
+    if header is None:
+        return None
+    data = _recvAll(sock, struct.unpack(str('!I'), header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+class CachedResponse(object):
+    '''
+    Already serialized json response, with its entity tag.
+    Modules can return it instead of plain data for responses that change rarely, so they are serialized just once
+    and clients sending a matching "If-None-Match" header get a "304 Not Modified" instead of the whole response
+    '''
+    def __init__(self, data=None, serialized=None, etag=None):
+        self.serialized = serialized if serialized is not None else json.dumps(data)
+        self.etag = etag or '"{}"'.format(hashlib.sha1(self.serialized.encode('utf-8')).hexdigest())
+
+
+class ForwardedHeaders(dict):
+    '''
+    Case insensitive headers dict, as the one received by modules when the request is
+    processed on the main process on behalf of a pre-forked worker
+    '''
+    def __init__(self, items):
+        dict.__init__(self, ((k.lower(), v) for k, v in items))
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self, key.lower())
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key.lower())
+
+    def get(self, key, default=None):
+        return dict.get(self, key.lower(), default)
+
+
+class ForwardedRequest(object):
+    '''
+    Stands for the request handler ("server" parameter of modules) on requests forwarded from pre-forked workers
+    '''
+    def __init__(self, headers, clientAddress):
+        self.headers = ForwardedHeaders(headers)
+        self.client_address = tuple(clientAddress)
+
+
+class ServiceProxy(object):
+    '''
+    Used inside pre-forked workers: forwards the already parsed request to main service process
+    (where modules, and so all their state, lives) and waits for the result.
+    Many handler threads can share the channel, responses are matched by request id.
+    '''
+    def __init__(self, channel):
+        self.channel = channel
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.counter = 0
+        self.reader = threading.Thread(target=self.readResponses)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def readResponses(self):
+        while True:
+            try:
+                response = _recvFrame(self.channel)
+            except Exception:
+                response = None
+            if response is None:
+                # Main process has gone, nothing left to do here
+                os._exit(0)  # pylint: disable=protected-access
+            with self.lock:
+                waiter = self.pending.pop(response['id'], None)
+            if waiter is not None:
+                waiter[1] = response
+                waiter[0].set()
+
+    def processServerMessage(self, module, path, getParams, postParams, handler):
+        waiter = [threading.Event(), None]
+        with self.lock:
+            self.counter += 1
+            reqId = self.counter
+            self.pending[reqId] = waiter
+            _sendFrame(self.channel, {
+                'id': reqId,
+                'module': module.name if module is not None else None,
+                'path': path,
+                'get': getParams,
+                'post': postParams,
+                'headers': list(handler.headers.items()),
+                'client': handler.client_address
+            })
+        if not waiter[0].wait(FORWARD_TIMEOUT):
+            with self.lock:
+                self.pending.pop(reqId, None)
+            raise Exception('No response from agent service after {} seconds'.format(FORWARD_TIMEOUT))
+        response = waiter[1]
+        if response.get('busy'):
+            raise BusyError(response['error'])
+        if 'error' in response:
+            raise Exception(response['error'])
+        if 'cached' in response:
+            return CachedResponse(serialized=response['cached'], etag=response['etag'])
+        return response['data']
+
+
+class WorkerChannel(threading.Thread):
+    '''
+    Runs on main service process, one per pre-forked worker.
+    Processes requests forwarded by the worker, each one on its own thread (as ThreadingMixIn does)
+    '''
+    def __init__(self, service, channel, pid):
+        super(WorkerChannel, self).__init__()
+        self.daemon = True
+        self.service = service
+        self.channel = channel
+        self.pid = pid
+        self.address = None  # Address worker is listening on
+        self.lock = threading.Lock()
+
+    def processRequest(self, request):
+        response = {'id': request['id']}
+        try:
+            for v in self.service.modules:
+                if v.name == request['module']:  # Case Sensitive!!!!
+                    break
+            else:
+                raise Exception('Module {} not found'.format(request['module']))
+            handler = ForwardedRequest(request['headers'], request['client'])
+            data = processModuleMessage(v, request['path'], request['get'], request['post'], handler)
+            if isinstance(data, CachedResponse):
+                response['cached'], response['etag'] = data.serialized, data.etag
+            else:
+                response['data'] = data
+        except BusyError as e:
+            response['error'], response['busy'] = exceptionToMessage(e), True
+        except Exception as e:
+            logger.exception()
+            response['error'] = exceptionToMessage(e)
+
+        try:
+            with self.lock:
+                _sendFrame(self.channel, response)
+        except Exception as e:
+            logger.error('Could not send response to HTTP worker %s: %s', self.pid, e)
+
+    def run(self):
+        while True:
+            try:
+                request = _recvFrame(self.channel)
+            except Exception:
+                request = None
+            if request is None:
+                logger.debug('HTTP worker %s channel closed', self.pid)
+                break
+            threading.Thread(target=self.processRequest, args=(request,)).start()
+
+    def stop(self):
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except OSError:
+            pass
+        try:
+            self.channel.close()
+        except Exception:
+            pass
+        try:
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+
+
 class HTTPServerHandler(BaseHTTPRequestHandler):
     service = None
+    proxy = None  # Set on pre-forked workers, so requests are processed on main service process
     protocol_version = 'HTTP/1.0'
     server_version = 'OpenGnsys Agent Server'
     sys_version = ''
     
     def sendJsonError(self, code, message):
         self.send_response(code)
+        data = json.dumps({'error': message})
         self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', len(data))
         self.end_headers()
-        self.wfile.write(json.dumps({'error': message}))
+        self.wfile.write(data)
         return
 
     def sendJsonResponse(self, data):
+        if isinstance(data, CachedResponse):
+            return self.sendCachedResponse(data)
         self.send_response(200)
         data = json.dumps(data)
         self.send_header('Content-type', 'application/json')
@@ -67,6 +373,19 @@ class HTTPServerHandler(BaseHTTPRequestHandler):
         self.end_headers()
         # Send the html message
         self.wfile.write(data)
+
+    def sendCachedResponse(self, response):
+        if self.headers.get('If-None-Match') == response.etag:
+            self.send_response(304)
+            self.send_header('ETag', response.etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', len(response.serialized))
+        self.send_header('ETag', response.etag)
+        self.end_headers()
+        self.wfile.write(response.serialized)
         
     
     # parseURL
@@ -90,8 +409,14 @@ class HTTPServerHandler(BaseHTTPRequestHandler):
         Locates witch module will process the message based on path (first folder on url path)
         '''
         try:
-            data = module.processServerMessage(path, getParams, postParams, self)
+            if self.proxy is not None:
+                data = self.proxy.processServerMessage(module, path, getParams, postParams, self)
+            else:
+                data = processModuleMessage(module, path, getParams, postParams, self)
             self.sendJsonResponse(data)
+        except BusyError as e:
+            logger.debug('Request %s rejected: %s', self.path, e)
+            self.sendJsonError(503, exceptionToMessage(e))
         except Exception as e:
             logger.exception()
             self.sendJsonError(500, exceptionToMessage(e))
@@ -108,7 +433,7 @@ class HTTPServerHandler(BaseHTTPRequestHandler):
         try:
             length = int(self.headers.getheader('content-length'))
             content = self.rfile.read(length).decode('utf-8')
-            logger.debug('length: {}, content >>{}<<'.format(length, content))
+            logger.debug('length: %s, content >>%s<<', length, content)
             postParams = json.loads(content)
         except Exception as e:
             self.sendJsonError(500, exceptionToMessage(e))
@@ -117,34 +442,151 @@ class HTTPServerHandler(BaseHTTPRequestHandler):
             
 
     def log_error(self, fmt, *args):
-        logger.error('HTTP ' + fmt % args)
+        logger.error('HTTP ' + fmt, *args)
         
     def log_message(self, fmt, *args):
-        logger.info('HTTP ' + fmt % args)
+        logger.info('HTTP ' + fmt, *args)
         
 
 class HTTPThreadingServer(ThreadingMixIn, HTTPServer):
-    pass
+    reusePort = False
+
+    def server_bind(self):
+        if self.reusePort:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        HTTPServer.server_bind(self)
+
+
+def preforkSupported():
+    return sys.platform.startswith('linux') and hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')
+
 
 class HTTPServerThread(threading.Thread):
-    def __init__(self, address, service):
+    '''
+    HTTPS listener.
+    If workers > 1 (and platform supports it), N worker processes are pre-forked, each one listening on the
+    same port using SO_REUSEPORT, so TLS and JSON work is spread among processes.
+    Workers only parse the requests, that are forwarded to this (main service) process to be processed by modules,
+    so secret, sessions, locks, etc... are kept in just one place.
+    Workers exiting (i.e. crashed) are replaced by new ones, so capacity is kept.
+    '''
+    def __init__(self, address, service, workers=0):
         super(self.__class__, self).__init__()
 
         HTTPServerHandler.service = service  # Keep tracking of service so we can intercact with it
 
         self.certFile = createSelfSignedCert()
-        self.server = HTTPThreadingServer(address, HTTPServerHandler)
-        self.server.socket = ssl.wrap_socket(self.server.socket, certfile=self.certFile, server_side=True)
-        
-        logger.debug('Initialized HTTPS Server thread on {}'.format(address))
+        self.service = service
+        self.channels = []
+        self.channelsLock = threading.Lock()
+        self.stopEvent = threading.Event()
+
+        if workers > 1 and not preforkSupported():
+            logger.warn('Pre-forked HTTPS workers are not supported on this platform, using just one process')
+            workers = 0
+
+        if workers > 1:
+            self.server = None
+            self.serverAddress = self.prefork(address, service, workers)
+        else:
+            self.server = self.createServer(address)
+            self.serverAddress = self.server.server_address
+
+        logger.debug('Initialized HTTPS Server thread on %s', address)
+
+    def createServer(self, address, reusePort=False):
+        server = HTTPThreadingServer(address, HTTPServerHandler, bind_and_activate=False)
+        server.reusePort = reusePort
+        try:
+            server.server_bind()
+            server.server_activate()
+        except Exception:
+            server.server_close()
+            raise
+        server.socket = ssl.wrap_socket(server.socket, certfile=self.certFile, server_side=True)
+        return server
+
+    def prefork(self, address, service, workers):
+        serverAddress = None
+        for _ in range(workers):
+            channel = self.startWorker(address, service)
+            if serverAddress is None:
+                serverAddress = channel.address
+                address = serverAddress  # If port 0 was requested, all workers must share the same one
+            self.channels.append(channel)
+
+        return serverAddress
+
+    def startWorker(self, address, service):
+        '''
+        Forks a worker process listening on address, returning the channel (not yet started) to talk with it
+        '''
+        # Listening socket is bound here, so any error is raised on main process
+        server = self.createServer(address, reusePort=True)
+        parentEnd, childEnd = socket.socketpair()
+        for s in (parentEnd, childEnd):
+            s.settimeout(None)  # Default socket timeout is set by service
+
+        pid = os.fork()
+        if pid == 0:
+            logger.afterFork()
+            parentEnd.close()
+            for c in self.channels:
+                c.channel.close()
+            self.runWorker(server, childEnd)  # Never returns
+
+        childEnd.close()
+        channel = WorkerChannel(service, parentEnd, pid)
+        channel.address = server.server_address
+        server.server_close()
+        logger.debug('Started HTTPS worker process %s', pid)
+        return channel
+
+    def replaceExitedWorkers(self):
+        with self.channelsLock:
+            for i, c in enumerate(self.channels):
+                if c.is_alive() or self.stopEvent.is_set():
+                    continue
+                logger.error('HTTPS worker process %s has exited, starting a new one', c.pid)
+                c.stop()  # Reaps it
+                try:
+                    self.channels[i] = self.startWorker(c.address, self.service)
+                except Exception as e:
+                    logger.error('Could not start HTTPS worker process: %s', exceptionToMessage(e))
+                    continue  # Tried again on next check
+                self.channels[i].start()
+
+    @staticmethod
+    def runWorker(server, channel):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        try:
+            HTTPServerHandler.proxy = ServiceProxy(channel)
+            server.serve_forever()
+        except Exception as e:
+            logger.error('HTTPS worker %s failed: %s', os.getpid(), exceptionToMessage(e))
+        logger.flush()
+        os._exit(0)  # pylint: disable=protected-access
 
     def getServerUrl(self):
-        return 'https://{}:{}/'.format(self.server.server_address[0], self.server.server_address[1])
+        return 'https://{}:{}/'.format(self.serverAddress[0], self.serverAddress[1])
 
     def stop(self):
-        self.server.shutdown()
+        self.stopEvent.set()
+        if self.server is not None:
+            self.server.shutdown()
+        with self.channelsLock:
+            for c in self.channels:
+                c.stop()
 
     def run(self):
-        self.server.serve_forever()
+        if self.server is not None:
+            self.server.serve_forever()
+            return
+
+        for c in self.channels:
+            c.start()
+        while not self.stopEvent.wait(WORKER_CHECK):
+            self.replaceExitedWorkers()
 
     
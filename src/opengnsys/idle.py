@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Monitors user idle time, notifying when it crosses thresholds and when user becomes active again
+"""
+from __future__ import unicode_literals
+
+import threading
+
+from . import operations
+from .log import logger
+from .utils import exceptionToMessage
+
+MIN_INTERVAL = 1  # Minimum seconds between idle samples
+MAX_INTERVAL = 60  # Maximum seconds between idle samples while user is active
+IDLE_INTERVAL = 2  # Seconds between idle samples while user is idle, waiting for activity
+
+
+class IdleMonitor(threading.Thread):
+    """
+    Samples operations.getIdleDuration, invoking onIdle(threshold, idle) when idle time crosses a watched threshold
+    and onActive(threshold, idle) when user is active again after crossing it.
+    Idle time can not grow faster than the clock, so while user is active the next sample is taken just when the
+    nearest threshold may be reached (at most MAX_INTERVAL seconds later): rarely when far from thresholds, more often
+    near them. Once idle, it is sampled every IDLE_INTERVAL seconds to notice activity.
+    Callbacks are invoked on monitor thread.
+    """
+    def __init__(self, getIdle=operations.getIdleDuration):
+        super(IdleMonitor, self).__init__()
+        self.daemon = True
+        self.getIdle = getIdle
+        self.watches = []  # [threshold, onIdle, onActive, crossed]
+        self.lock = threading.Lock()
+        self.wakeEvent = threading.Event()
+        self.stopped = False
+
+    def watch(self, threshold, onIdle, onActive=None):
+        """
+        Watches an idle threshold, in seconds
+        """
+        with self.lock:
+            self.watches.append([threshold, onIdle, onActive, False])
+        self.wakeEvent.set()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeEvent.set()
+
+    def _notify(self, callback, threshold, idle):
+        if callback is None:
+            return
+        try:
+            callback(threshold, idle)
+        except Exception as e:
+            logger.error('Error processing idle notification: {}'.format(exceptionToMessage(e)))
+
+    def check(self):
+        """
+        Samples idle time, notifying crossed thresholds
+        Returns seconds to wait for next sample (None if there is nothing to watch)
+        """
+        with self.lock:
+            watches = list(self.watches)
+        if not watches:
+            return None
+
+        try:
+            idle = self.getIdle()
+        except Exception as e:
+            logger.debug('Could not get idle duration: %s', exceptionToMessage(e))
+            return MAX_INTERVAL
+
+        delay = MAX_INTERVAL
+        for watch in watches:
+            threshold, onIdle, onActive, crossed = watch
+            if idle >= threshold:
+                if not crossed:
+                    watch[3] = True
+                    logger.debug('Idle for %s seconds, threshold %s crossed', idle, threshold)
+                    self._notify(onIdle, threshold, idle)
+                delay = min(delay, IDLE_INTERVAL)
+            else:
+                if crossed:
+                    watch[3] = False
+                    logger.debug('Active again, threshold %s', threshold)
+                    self._notify(onActive, threshold, idle)
+                delay = min(delay, threshold - idle)
+        return max(delay, MIN_INTERVAL)
+
+    def run(self):
+        try:
+            while not self.stopped:
+                self.wakeEvent.clear()
+                self.wakeEvent.wait(self.check())
+        except Exception as e:
+            logger.error('Idle monitor stopped: {}'.format(exceptionToMessage(e)))
+        finally:
+            operations.closeIdleDuration()
@@ -106,7 +106,7 @@ class ClientProcessor(threading.Thread):
         self.running = False
 
     def processRequest(self, msg, data):
-        logger.debug('Got Client message {}={}'.format(msg, REV_DICT.get(msg)))
+        logger.debug('Got Client message %s=%s', msg, REV_DICT.get(msg))
         if self.parent.clientMessageProcessor is not None:
             self.parent.clientMessageProcessor(msg, data)
 
@@ -130,20 +130,20 @@ class ClientProcessor(threading.Thread):
                     buf = six.byte2int(b)  # Empty buffer, this is set as non-blocking
                     if state is None:
                         if buf in (REQ_MESSAGE, REQ_LOGIN, REQ_LOGOUT):
-                            logger.debug('State set to {}'.format(buf))
+                            logger.debug('State set to %s', buf)
                             state = buf
                             recv_msg = buf
                             continue  # Get next byte
                         else:
-                            logger.debug('Got unexpected data {}'.format(buf))
+                            logger.debug('Got unexpected data %s', buf)
                     elif state in (REQ_MESSAGE, REQ_LOGIN, REQ_LOGOUT):
-                        logger.debug('First length byte is {}'.format(buf))
+                        logger.debug('First length byte is %s', buf)
                         msg_len = buf
                         state = ST_SECOND_BYTE
                         continue
                     elif state == ST_SECOND_BYTE:
                         msg_len += buf << 8
-                        logger.debug('Second length byte is {}, len is {}'.format(buf, msg_len))
+                        logger.debug('Second length byte is %s, len is %s', buf, msg_len)
                         if msg_len == 0:
                             self.processRequest(recv_msg, None)
                             state = None
@@ -160,13 +160,13 @@ class ClientProcessor(threading.Thread):
                             state = None
                             break
                     else:
-                        logger.debug('Got invalid message from request: {}, state: {}'.format(buf, state))
+                        logger.debug('Got invalid message from request: %s, state: %s', buf, state)
             except socket.error as e:
                 # If no data is present, no problem at all, pass to check messages
                 pass
             except Exception as e:
                 tb = traceback.format_exc()
-                logger.error('Error: {}, trace: {}'.format(e, tb))
+                logger.error('Error: %s, trace: %s', e, tb)
 
             if self.running is False:
                 break
@@ -176,7 +176,7 @@ class ClientProcessor(threading.Thread):
             except six.moves.queue.Empty:  # No message got in time @UndefinedVariable
                 continue
 
-            logger.debug('Got message {}={}'.format(msg, REV_DICT.get(msg[0])))
+            logger.debug('Got message %s=%s', msg, REV_DICT.get(msg[0]))
 
             try:
                 m = msg[1] if msg[1] is not None else b''
@@ -186,10 +186,10 @@ class ClientProcessor(threading.Thread):
                     self.clientSocket.sendall(data)
                 except socket.error as e:
                     # Send data error
-                    logger.debug('Socket connection is no more available: {}'.format(e.args))
+                    logger.debug('Socket connection is no more available: %s', e.args)
                     self.running = False
             except Exception as e:
-                logger.error('Invalid message in queue: {}'.format(e))
+                logger.error('Invalid message in queue: %s', e)
 
         logger.debug('Client processor stopped')
         try:
@@ -224,7 +224,7 @@ class ServerIPC(threading.Thread):
         '''
         Notify message to all listening threads
         '''
-        logger.debug('Sending message {}({}),{} to all clients'.format(msgId, REV_DICT.get(msgId), msgData))
+        logger.debug('Sending message %s(%s),%s to all clients', msgId, REV_DICT.get(msgId), msgData)
 
         # Convert to bytes so length is correctly calculated
         if isinstance(msgData, six.text_type):
@@ -232,7 +232,7 @@ class ServerIPC(threading.Thread):
 
         for t in self.threads:
             if t.isAlive():
-                logger.debug('Sending to {}'.format(t))
+                logger.debug('Sending to %s', t)
                 t.messages.put((msgId, msgData))
 
     def sendLoggofMessage(self):
@@ -254,7 +254,7 @@ class ServerIPC(threading.Thread):
         aliveThreads = []
         for t in self.threads:
             if t.isAlive():
-                logger.debug('Thread {} is alive'.format(t))
+                logger.debug('Thread %s is alive', t)
                 aliveThreads.append(t)
         self.threads[:] = aliveThreads
 
@@ -271,16 +271,16 @@ class ServerIPC(threading.Thread):
                 # Stop processing if thread is mean to stop
                 if self.running is False:
                     break
-                logger.debug('Got connection from {}'.format(address))
+                logger.debug('Got connection from %s', address)
 
                 self.cleanupFinishedThreads()  # House keeping
 
-                logger.debug('Starting new thread, current: {}'.format(self.threads))
+                logger.debug('Starting new thread, current: %s', self.threads)
                 t = ClientProcessor(self, clientSocket)
                 self.threads.append(t)
                 t.start()
             except Exception as e:
-                logger.error('Got an exception on Server ipc thread: {}'.format(e))
+                logger.error('Got an exception on Server ipc thread: %s', e)
 
 
 class ClientIPC(threading.Thread):
@@ -306,7 +306,7 @@ class ClientIPC(threading.Thread):
         return None
 
     def sendRequestMessage(self, msg, data=None):
-        logger.debug('Sending request for msg: {}({}), {}'.format(msg, REV_DICT.get(msg), data))
+        logger.debug('Sending request for msg: %s(%s), %s', msg, REV_DICT.get(msg), data)
         if data is None:
             data = b''
 
@@ -346,7 +346,7 @@ class ClientIPC(threading.Thread):
             try:
                 buf = self.clientSocket.recv(number - len(msg))
                 if buf == b'':
-                    logger.debug('Buf {}, msg {}({})'.format(buf, msg, REV_DICT.get(msg)))
+                    logger.debug('Buf %s, msg %s(%s)', buf, msg, REV_DICT.get(msg))
                     self.running = False
                     break
                 msg += buf
@@ -409,12 +409,12 @@ class ClientIPC(threading.Thread):
                 self.messageReceived()
 
             except socket.error as e:
-                logger.error('Communication with server got an error: {}'.format(toUnicode(e.strerror)))
+                logger.error('Communication with server got an error: %s', toUnicode(e.strerror))
                 self.running = False
                 return
             except Exception as e:
                 tb = traceback.format_exc()
-                logger.error('Error: {}, trace: {}'.format(e, tb))
+                logger.error('Error: %s, trace: %s', e, tb)
 
         try:
             self.clientSocket.close()
@@ -93,7 +93,7 @@ def usage():
     sys.stderr.write("usage: {} start|stop|restart|fg|login 'username'|logout 'username'|message 'module' 'message' 'json'\n".format(sys.argv[0]))
     sys.exit(2)
 
-if __name__ == '__main__':
+def main():
     logger.setLevel('INFO')
     
     if len(sys.argv) == 5 and sys.argv[1] == 'message':
@@ -145,3 +145,7 @@ if __name__ == '__main__':
         sys.exit(0)
     else:
         usage()
+
+
+if __name__ == '__main__':
+    main()
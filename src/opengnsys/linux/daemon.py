@@ -83,6 +83,7 @@ class Daemon:
             logger.error("fork #2 error: {}".format(e))
             sys.stderr.write("fork #2 failed: {}\n".format(e))
             sys.exit(1)
+        logger.afterFork(rotate=True)  # Parent process (that set up log rotation) has exited
 
         # redirect standard file descriptors
         sys.stdout.flush()
@@ -31,11 +31,12 @@
 '''
 from __future__ import unicode_literals
 
-import logging
 import os
 import tempfile
 import six
 
+from opengnsys.loghandler import createFileLogger, logRecord, noBatch
+
 # Valid logging levels, from UDS Broker (uds.core.utils.log)
 OTHER, DEBUG, INFO, WARN, ERROR, FATAL = (10000 * (x + 1) for x in six.moves.xrange(6))  # @UndefinedVariable
 
@@ -51,27 +52,36 @@ class LocalLogger(object):
         for logDir in ('/var/log', os.path.expanduser('~'), tempfile.gettempdir()):
             try:
                 fname = os.path.join(logDir, 'opengnsys.log')
-                logging.basicConfig(
-                    filename=fname,
-                    filemode='a',
-                    format='%(levelname)s %(asctime)s %(message)s',
-                    level=logging.DEBUG
-                )
-                self.logger = logging.getLogger('opengnsys')
-                os.chmod(fname, 0o0600)
+                self.logger, self.handler = createFileLogger(fname, 0o0600)
                 return
             except Exception:
                 pass
 
         # Logger can't be set
-        self.logger = None
+        self.logger = self.handler = None
 
-    def log(self, level, message):
+    def log(self, level, message, created=None, threadName=None):
         # Debug messages are logged to a file
         # our loglevels are 10000 (other), 20000 (debug), ....
         # logging levels are 10 (debug), 20 (info)
         # OTHER = logging.NOTSET
-        self.logger.log(int(level / 1000) - 10, message)
+        logRecord(self.logger, int(level / 1000) - 10, message, created, threadName)
+
+    def setRotation(self, maxBytes, maxAge, backupCount):
+        if self.handler is not None:
+            self.handler.setRotation(maxBytes, maxAge, backupCount)
+
+    def afterFork(self, rotate=False):
+        if self.handler is not None:
+            self.handler.createLock()
+            if rotate:
+                self.handler.claimRotation()
+
+    def batch(self):
+        '''
+        Context manager for logging several messages, writing them to disk at once
+        '''
+        return self.handler.batch() if self.handler is not None else noBatch()
 
     def isWindows(self):
         return False
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Minimal rtnetlink client, used to get network interfaces and addresses (and their changes) from the kernel
+"""
+from __future__ import unicode_literals
+
+import os
+import socket
+import struct
+import threading
+
+import six
+
+NETLINK_ROUTE = 0
+RECV_SIZE = 65536
+
+# Message types
+NLMSG_ERROR, NLMSG_DONE = 2, 3
+RTM_NEWLINK, RTM_DELLINK, RTM_GETLINK = 16, 17, 18
+RTM_NEWADDR, RTM_DELADDR, RTM_GETADDR = 20, 21, 22
+
+# Flags
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_DUMP = 0x300
+
+# Multicast groups
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+# Attributes
+IFLA_ADDRESS, IFLA_IFNAME = 1, 3
+IFA_ADDRESS, IFA_LOCAL, IFA_LABEL = 1, 2, 3
+
+IFF_UP = 0x1
+IFF_LOOPBACK = 0x8
+
+_nlmsghdr = struct.Struct(str('=LHHLL'))  # length, type, flags, sequence, pid
+_ifinfomsg = struct.Struct(str('=BxHiII'))  # family, type, index, flags, change
+_ifaddrmsg = struct.Struct(str('=BBBBI'))  # family, prefix length, flags, scope, index
+_rtattr = struct.Struct(str('=HH'))  # length, type
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _attributes(data, offset):
+    """
+    Returns rtattrs of a message as a dict (type: raw value)
+    """
+    attrs = {}
+    while offset + _rtattr.size <= len(data):
+        length, attrType = _rtattr.unpack_from(data, offset)
+        if length < _rtattr.size:
+            break
+        attrs[attrType] = data[offset + _rtattr.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def _string(value):
+    return value.split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+
+def _mac(value):
+    return six.text_type(':'.join('%02x' % b for b in bytearray(value[:6]))) if value else None
+
+
+def parseMessages(data):
+    """
+    Parses a netlink datagram, returning a list of (type, flags, sequence, message), where message is a dict for
+    links ("index", "name", "mac", "flags") and addresses ("index", "ip", "prefixlen", "label"), and None for
+    any other type (errors are returned as an int, the negative errno)
+    """
+    res = []
+    offset = 0
+    while offset + _nlmsghdr.size <= len(data):
+        length, msgType, flags, seq, _ = _nlmsghdr.unpack_from(data, offset)
+        if length < _nlmsghdr.size:
+            break
+        body = offset + _nlmsghdr.size
+        msg = None
+        if msgType in (RTM_NEWLINK, RTM_DELLINK):
+            _, _, index, ifFlags, _ = _ifinfomsg.unpack_from(data, body)
+            attrs = _attributes(data[:offset + length], body + _ifinfomsg.size)
+            msg = {'index': index, 'flags': ifFlags, 'name': _string(attrs.get(IFLA_IFNAME, b'')),
+                   'mac': _mac(attrs.get(IFLA_ADDRESS))}
+        elif msgType in (RTM_NEWADDR, RTM_DELADDR):
+            family, prefixLen, _, _, index = _ifaddrmsg.unpack_from(data, body)
+            attrs = _attributes(data[:offset + length], body + _ifaddrmsg.size)
+            address = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+            msg = {'index': index, 'family': family, 'prefixlen': prefixLen,
+                   'ip': six.text_type(socket.inet_ntop(family, address)) if address else None,
+                   'label': _string(attrs[IFA_LABEL]) if IFA_LABEL in attrs else None}
+        elif msgType == NLMSG_ERROR:
+            msg = struct.unpack_from(str('=i'), data, body)[0]
+        res.append((msgType, flags, seq, msg))
+        offset += _align(length)
+    return res
+
+
+def openSocket(groups=0):
+    """
+    Opens a rtnetlink socket, subscribed to groups (multicast groups mask, i.e. RTMGRP_LINK)
+    """
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    sock.bind((0, groups))
+    return sock
+
+
+class RouteSocket(object):
+    """
+    Sends dump requests to kernel, using the same socket for every request (safe to be used among threads)
+    """
+    def __init__(self):
+        self.sock = None
+        self.pid = None
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def close(self):
+        with self.lock:
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+
+    def dump(self, msgType, family=socket.AF_UNSPEC):
+        """
+        Returns every message (as parsed by parseMessages) of a dump request (i.e. RTM_GETLINK)
+        """
+        with self.lock:
+            if self.sock is None or self.pid != os.getpid():  # Sockets must not be shared with forked processes
+                self.sock = openSocket()
+                self.pid = os.getpid()
+            self.seq += 1
+            try:
+                # Request body is a rtgenmsg, just the family (padded)
+                self.sock.send(_nlmsghdr.pack(_nlmsghdr.size + 4, msgType, NLM_F_REQUEST | NLM_F_DUMP, self.seq,
+                                              0) + struct.pack(str('=Bxxx'), family))
+                return self._receive()
+            except Exception:
+                self.sock.close()  # Socket state is unknown, so it's not reused
+                self.sock = None
+                raise
+
+    def _receive(self):
+        res = []
+        while True:
+            for rType, _, seq, msg in parseMessages(self.sock.recv(RECV_SIZE)):
+                if seq != self.seq:
+                    continue  # Answer to a previous (failed) request
+                if rType == NLMSG_DONE:
+                    return res
+                if rType == NLMSG_ERROR:
+                    raise OSError(-msg, os.strerror(-msg))
+                res.append(msg)
+
+
+_routeSocket = RouteSocket()
+
+
+def getInterfaces():
+    """
+    Returns every network interface, as a list of dicts with "index", "name", "mac", "flags" and "addresses" (list
+    of IPv4 addresses, as dicts with "ip", "prefixlen" and "label")
+    rtnetlink dumps just one object type per request, and kernel refuses a new dump on a socket while other one is
+    in progress, so links and addresses take two consecutive dumps (on the same socket, with no process spawned)
+    """
+    links = _routeSocket.dump(RTM_GETLINK)
+    addresses = _routeSocket.dump(RTM_GETADDR, socket.AF_INET)
+    res = []
+    for link in links:
+        link['addresses'] = [a for a in addresses if a['index'] == link['index']]
+        res.append(link)
+    return res
@@ -32,19 +32,22 @@
 from __future__ import unicode_literals
 
 import socket
-import platform
-import fcntl
 import os
 import locale
 import ctypes  # @UnusedImport
 import ctypes.util
 import subprocess
-import struct
-import array
+import threading
 import six
-import distro
 from opengnsys import utils
-from .renamer import rename
+from . import netlink
+
+
+def _getInterfaces():
+    '''
+    Returns network interfaces with their mac and IPv4 addresses, as obtained from kernel (rtnetlink)
+    '''
+    return netlink.getInterfaces()
 
 
 def _getMacAddr(ifname):
@@ -54,14 +57,10 @@ def _getMacAddr(ifname):
     '''
     if isinstance(ifname, list):
         return dict([(name, _getMacAddr(name)) for name in ifname])
-    if isinstance(ifname, six.text_type):
-        ifname = ifname.encode('utf-8')  # If unicode, convert to bytes (or str in python 2.7)
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        info = bytearray(fcntl.ioctl(s.fileno(), 0x8927, struct.pack(str('256s'), ifname[:15])))
-        return six.text_type(''.join(['%02x:' % char for char in info[18:24]])[:-1])
-    except Exception:
-        return None
+    for iface in _getInterfaces():
+        if iface['name'] == ifname:
+            return iface['mac']
+    return None
 
 
 def _getIpAddr(ifname):
@@ -71,47 +70,11 @@ def _getIpAddr(ifname):
     '''
     if isinstance(ifname, list):
         return dict([(name, _getIpAddr(name)) for name in ifname])
-    if isinstance(ifname, six.text_type):
-        ifname = ifname.encode('utf-8')  # If unicode, convert to bytes (or str in python 2.7)
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        return six.text_type(socket.inet_ntoa(fcntl.ioctl(
-            s.fileno(),
-            0x8915,  # SIOCGIFADDR
-            struct.pack(str('256s'), ifname[:15])
-        )[20:24]))
-    except Exception:
-        return None
-
-
-def _getInterfaces():
-    '''
-    Returns a list of interfaces names coded in utf-8
-    '''
-    max_possible = 128  # arbitrary. raise if needed.
-    space = max_possible * 16
-    if platform.architecture()[0] == '32bit':
-        offset, length = 32, 32
-    elif platform.architecture()[0] == '64bit':
-        offset, length = 16, 40
-    else:
-        raise OSError('Unknown arquitecture {0}'.format(platform.architecture()[0]))
-
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    names = array.array(str('B'), b'\0' * space)
-    outbytes = struct.unpack(str('iL'), fcntl.ioctl(
-        s.fileno(),
-        0x8912,  # SIOCGIFCONF
-        struct.pack(str('iL'), space, names.buffer_info()[0])
-    ))[0]
-    namestr = names.tostring()
-    # return namestr, outbytes
-    return [namestr[i:i + offset].split(b'\0', 1)[0].decode('utf-8') for i in range(0, outbytes, length)]
-
-
-def _getIpAndMac(ifname):
-    ip, mac = _getIpAddr(ifname), _getMacAddr(ifname)
-    return (ip, mac)
+    for iface in _getInterfaces():
+        for address in iface['addresses']:
+            if ifname in (iface['name'], address['label']):
+                return address['ip']
+    return None
 
 
 def getComputerName():
@@ -129,20 +92,24 @@ def getNetworkInfo():
       mac: mac of the interface
       ip: ip of the interface
     '''
-    for ifname in _getInterfaces():
-        ip, mac = _getIpAndMac(ifname)
-        if mac != '00:00:00:00:00:00':  # Skips local interfaces
-            yield utils.Bunch(name=ifname, mac=mac, ip=ip)
+    for iface in _getInterfaces():
+        mac = iface['mac'] or '00:00:00:00:00:00'
+        if mac == '00:00:00:00:00:00':  # Skips local interfaces
+            continue
+        for address in iface['addresses']:  # Every IPv4 address (aliases included)
+            yield utils.Bunch(name=address['label'] or iface['name'], mac=mac, ip=address['ip'])
 
 
 def getDomainName():
     return ''
 
 
+@utils.memoized
 def getLinuxVersion():
     """
     Returns the version of the Linux distribution
     """
+    import distro
     return distro.os_release_attr('pretty_name')
 
 
@@ -192,6 +159,7 @@ def logoff():
 
 
 def renameComputer(newName):
+    from .renamer import rename
     rename(newName)
 
 
@@ -207,25 +175,85 @@ def changeUserPassword(user, oldPassword, newPassword):
 
 
 class XScreenSaverInfo(ctypes.Structure):
-    _fields_ = [('window', ctypes.c_long),
+    _fields_ = [('window', ctypes.c_ulong),
                 ('state', ctypes.c_int),
                 ('kind', ctypes.c_int),
                 ('til_or_since', ctypes.c_ulong),
                 ('idle', ctypes.c_ulong),
                 ('eventMask', ctypes.c_ulong)]
 
-# Initialize xlib & xss
-try:
-    xlibPath = ctypes.util.find_library('X11')
-    xssPath = ctypes.util.find_library('Xss')
-    xlib = ctypes.cdll.LoadLibrary(xlibPath)
-    xss = ctypes.cdll.LoadLibrary(xssPath)
 
-    # Fix result type to XScreenSaverInfo Structure
-    xss.XScreenSaverQueryExtension.restype = ctypes.c_int
-    xss.XScreenSaverAllocInfo.restype = ctypes.POINTER(XScreenSaverInfo)  # Result in a XScreenSaverInfo structure
-except Exception:  # Libraries not accesible, not found or whatever..
-    xlib = xss = None
+@utils.memoized
+def _getXLibraries():
+    '''
+    Loads xlib & xss on first use (finding them may spawn ldconfig or gcc), returns (None, None) if not available
+    '''
+    try:
+        xlibPath = ctypes.util.find_library('X11')
+        xssPath = ctypes.util.find_library('Xss')
+        xlib = ctypes.cdll.LoadLibrary(xlibPath)
+        xss = ctypes.cdll.LoadLibrary(xssPath)
+
+        # Display pointers and window ids must not be truncated to int
+        xlib.XOpenDisplay.restype = ctypes.c_void_p
+        xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+        xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        xlib.XFree.argtypes = [ctypes.c_void_p]
+        xss.XScreenSaverQueryExtension.restype = ctypes.c_int
+        xss.XScreenSaverQueryExtension.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int),
+                                                   ctypes.POINTER(ctypes.c_int)]
+        # Fix result type to XScreenSaverInfo Structure
+        xss.XScreenSaverAllocInfo.restype = ctypes.POINTER(XScreenSaverInfo)  # Result in a XScreenSaverInfo structure
+        xss.XScreenSaverQueryInfo.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(XScreenSaverInfo)]
+    except Exception:  # Libraries not accesible, not found or whatever..
+        return None, None
+    return xlib, xss
+
+
+class _IdleDisplay(object):
+    '''
+    Connection to X display used to get idle time, opened on first use and kept open (with its XScreenSaverInfo)
+    '''
+    def __init__(self):
+        self.display = None
+        self.info = None
+        self.root = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        xlib, xss = _getXLibraries()
+        display = xlib.XOpenDisplay(None)
+        if not display:
+            return False
+        event_base = ctypes.c_int()
+        error_base = ctypes.c_int()
+        if xss.XScreenSaverQueryExtension(display, ctypes.byref(event_base), ctypes.byref(error_base)) != 1:
+            xlib.XCloseDisplay(display)
+            return False
+        self.display = display
+        self.root = xlib.XDefaultRootWindow(display)
+        self.info = xss.XScreenSaverAllocInfo()
+        return True
+
+    def close(self):
+        with self.lock:
+            if self.display is not None:
+                xlib = _getXLibraries()[0]
+                xlib.XFree(self.info)
+                xlib.XCloseDisplay(self.display)
+                self.display = self.info = self.root = None
+
+    def getIdle(self):
+        with self.lock:
+            if self.display is None and not self.open():
+                return None
+            _getXLibraries()[1].XScreenSaverQueryInfo(self.display, self.root, self.info)
+            return self.info.contents.state, self.info.contents.idle
+
+
+_idleDisplay = _IdleDisplay()
 
 
 def initIdleDuration(atLeastSeconds):
@@ -234,7 +262,6 @@ def initIdleDuration(atLeastSeconds):
     '''
     # Workaround for dummy thread
     if six.PY3 is False:
-        import threading
         threading._DummyThread._Thread__stop = lambda x: 42
 
     subprocess.call(['/usr/bin/xset', 's', '{}'.format(atLeastSeconds + 30)])
@@ -245,27 +272,27 @@ def initIdleDuration(atLeastSeconds):
 def getIdleDuration():
     '''
     Returns idle duration, in seconds
+    Display connection is kept open between calls, use closeIdleDuration to release it
     '''
-    if xlib is None or xss is None:
+    if _getXLibraries()[0] is None:
         return 0  # Libraries not available
 
-    # production code might want to not hardcode the offset 16...
-    display = xlib.XOpenDisplay(None)
+    idle = _idleDisplay.getIdle()
+    if idle is None:
+        return 0  # No display or no screen saver is available, no way of getting idle
 
-    event_base = ctypes.c_int()
-    error_base = ctypes.c_int()
+    state, millis = idle
+    if state != 0:
+        return 3600 * 100 * 1000  # If screen saver is active, return a high enough value
 
-    available = xss.XScreenSaverQueryExtension(display, ctypes.byref(event_base), ctypes.byref(error_base))
-    if available != 1:
-        return 0  # No screen saver is available, no way of getting idle
+    return millis / 1000.0
 
-    info = xss.XScreenSaverAllocInfo()
-    xss.XScreenSaverQueryInfo(display, xlib.XDefaultRootWindow(display), info)
 
-    if info.contents.state != 0:
-        return 3600 * 100 * 1000  # If screen saver is active, return a high enough value
-
-    return info.contents.idle / 1000.0
+def closeIdleDuration():
+    '''
+    Closes display connection used by getIdleDuration
+    '''
+    _idleDisplay.close()
 
 
 def getCurrentUser():
@@ -303,3 +330,18 @@ def get_etc_path():
     Returns etc directory path.
     """
     return os.sep + 'etc'
+
+
+def get_state_path():
+    """
+    :return:
+    Returns directory path for agent state kept across restarts (only accessible by agent).
+    """
+    return os.path.join(os.sep, 'var', 'lib', 'ogagent')
+
+
+def initThread():
+    '''
+    Prepares a thread (other than main one) for using operations, nothing is needed here
+    '''
+    pass
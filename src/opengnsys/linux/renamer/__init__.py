@@ -32,18 +32,18 @@
 from __future__ import unicode_literals
 
 import platform
-import os
-import sys
-import pkgutil
 
 from opengnsys.log import logger
+from opengnsys.utils import memoized
+from opengnsys.bundle import listModules
 
 renamers = {}
 
 
 # Renamers now are for IPv4 only addresses
 def rename(newName):
-    distribution = platform.linux_distribution()[0].lower().strip()
+    _init()
+    distribution = _getDistribution()
     if distribution in renamers:
         return renamers[distribution](newName)
 
@@ -52,10 +52,13 @@ def rename(newName):
     return renamers['debian'](newName)
 
 
-# Do load of packages
+@memoized
+def _getDistribution():
+    return platform.linux_distribution()[0].lower().strip()
+
+
+# Do load of packages, on first rename
+@memoized
 def _init():
-    pkgpath = os.path.dirname(sys.modules[__name__].__file__)
-    for _, name, _ in pkgutil.iter_modules([pkgpath]):
+    for name, _ in listModules(__name__):
         __import__(__name__ + '.' + name, globals(), locals())
-
-_init()
\ No newline at end of file
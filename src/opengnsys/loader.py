@@ -25,7 +25,6 @@
 # CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
-
 '''
 @author: Adolfo Gómez, dkmaster at dkmon dot com
 '''
@@ -35,77 +34,228 @@
 # Modules under "opengsnsys/modules" are always autoloaded
 from __future__ import unicode_literals
 
+import importlib
+import json
+import os
 import pkgutil
-import os.path
+import sys
+import tempfile
 
 from opengnsys.workers import ServerWorker
 from opengnsys.workers import ClientWorker
+from . import operations
+from . import utils
+from .bundle import getBundle, listModules
 from .log import logger
 
+MANIFEST_VERSION = 1  # Increment if manifest contents change
+
+
+def _treeSignature(path):
+    '''
+    Returns number of source files under path and newest modification time of them (and their folders)
+    '''
+    files, newest = 0, 0
+    for dirPath, _, fileNames in os.walk(path):
+        newest = max(newest, os.path.getmtime(dirPath))
+        for fileName in fileNames:
+            if fileName.endswith('.py'):
+                files += 1
+                newest = max(newest, os.path.getmtime(os.path.join(dirPath, fileName)))
+    return [files, newest]
+
+
+def _manifestFile(modPath, client):
+    '''
+    Returns manifest path: on agent state folder for service, and on temp folder for user application (one per user)
+    or None if state folder is not safe
+    '''
+    kind = modPath.rsplit('.', 1)[1]
+    if client:
+        uid = os.getuid() if hasattr(os, 'getuid') else 0
+        return os.path.join(tempfile.gettempdir(), 'ogagent-{}-{}.json'.format(kind, uid))
+    try:
+        return os.path.join(utils.makePrivateDir(operations.get_state_path()), 'modules-{}.json'.format(kind))
+    except Exception as e:
+        logger.warn('Modules manifest will not be used: {}'.format(e))
+        return None
+
+
+def _readManifest(fileName, key):
+    '''
+    Returns cached manifest entries, or None if there is no manifest or it was made for other module trees
+    '''
+    try:
+        with open(fileName, 'r') as f:
+            if os.name == 'posix':
+                # Manifest tells which modules are imported, so only trust our own (not writable by others) ones
+                st = os.fstat(f.fileno())
+                if st.st_uid != os.getuid() or st.st_mode & 0o022:
+                    logger.warn('Ignoring modules manifest {}, it is not safe'.format(fileName))
+                    return None
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if manifest.get('key') != key:
+        return None
+    return manifest['entries']
+
+
+def _writeManifest(fileName, key, entries):
+    tmpName = None
+    try:
+        fd, tmpName = tempfile.mkstemp(prefix=os.path.basename(fileName) + '.', dir=os.path.dirname(fileName))
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'key': key, 'entries': entries}, f)
+        if os.name != 'posix' and os.path.exists(fileName):
+            os.remove(fileName)  # Windows can't rename over an existing file
+        os.rename(tmpName, fileName)
+    except (IOError, OSError) as e:
+        logger.warn('Could not write modules manifest {}: {}'.format(fileName, e))
+        if tmpName is not None and os.path.exists(tmpName):
+            os.remove(tmpName)
+
+
+def _loadPackage(name, path):
+    '''
+    Imports a module package, from path if it's an external one (None for own modules)
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+    if path is None:
+        return importlib.import_module(name)
+    return pkgutil.ImpImporter(path).find_module(name).load_module(name)
+
+
+def _scanModules(modPath, modType, paths):
+    '''
+    Imports every module package, returning manifest entries (package, path and worker classes found on it)
+    '''
+    entries = [{'package': '{}.{}'.format(modPath, name), 'path': None}
+               for name, ispkg in listModules(modPath) if ispkg]
+    for path in paths:
+        for (_, name, ispkg) in pkgutil.iter_modules([path], modPath + '.'):
+            if ispkg:
+                entries.append({'package': name, 'path': path})
+    return _scanPackages(entries, modType)
+
+
+def _scanPackages(entries, modType):
+    '''
+    Imports module packages of manifest entries, filling their worker classes
+    Packages that can't be imported are kept, marked as failed, so they are scanned again on next load (failure
+    could be caused by something outside them, i.e. a missing dependency)
+    '''
+    for entry in entries:
+        logger.debug('Found module package {}'.format(entry['package']))
+        entry['workers'] = []
+        entry.pop('failed', None)
+        try:
+            _loadPackage(entry['package'], entry['path'])
+        except Exception as e:
+            logger.error('Error loading module package {}: {}'.format(entry['package'], e))
+            entry['failed'] = True
+
+    def recursiveAdd(p):
+        subcls = p.__subclasses__()
+
+        if len(subcls) == 0:
+            addCls(p)
+        else:
+            for c in subcls:
+                recursiveAdd(c)
+
+    def addCls(cls):
+        logger.debug('Found module class {}'.format(cls))
+        if cls.name is None:
+            # Error, cls has no name
+            # Log the issue and
+            logger.error('Class {} has no name attribute'.format(cls))
+            return
+        for entry in entries:
+            if cls.__module__ == entry['package'] or cls.__module__.startswith(entry['package'] + '.'):
+                entry['workers'].append([cls.name, cls.__module__, cls.__name__])
+                return
+        logger.debug('Class {} is not inside a module package, ignored'.format(cls))
+
+    recursiveAdd(modType)
+
+    return [entry for entry in entries if entry['workers'] or entry.get('failed')]
+
 
 def loadModules(controller, client=False):
     '''
     Load own provided modules plus the modules that are in the configuration path.
     The loading order is not defined (they are loaded as found, because modules MUST be "standalone" modules
+    Module packages are only scanned (imported to find their classes) if they have changed since last time,
+    otherwise they are found on a manifest, and only imported if enabled (missing or true "enabled" option on
+    module section of configuration).
     @param service: The service that:
        * Holds the configuration
        * Will be used to initialize modules.
     '''
 
     ogModules = []
-    
+
     if client is False:
-        from opengnsys.modules.server import OpenGnSys  # @UnusedImport
         from .modules import server  # @UnusedImport, just used to ensure opengnsys modules are initialized
         modPath = 'opengnsys.modules.server'
         modType = ServerWorker
     else:
-        from opengnsys.modules.client import OpenGnSys  # @UnusedImport @Reimport
         from .modules import client  # @UnusedImport, just used to ensure opengnsys modules are initialized
         modPath = 'opengnsys.modules.client'
         modType = ClientWorker
-    
-    def addCls(cls):
-        logger.debug('Found module class {}'.format(cls))
-        try:
-            if cls.name is None:
-                # Error, cls has no name
-                # Log the issue and 
-                logger.error('Class {} has no name attribute'.format(cls))
-                return
-            ogModules.append(cls(controller))
-        except Exception as e:
-            logger.error('Error loading module {}'.format(e))
 
-    def recursiveAdd(p):
-        subcls = p.__subclasses__()
-        
-        if len(subcls) == 0:
-            addCls(p) 
-        else:
-            for c in subcls:
-                recursiveAdd(c)
-
-    def doLoad(paths):
-        for (module_loader, name, ispkg) in pkgutil.iter_modules(paths, modPath + '.'):
-            if ispkg:
-                logger.debug('Found module package {}'.format(name))
-                module_loader.find_module(name).load_module(name)
-
-    
     if controller.config.has_option('opengnsys', 'path') is True:
         paths = tuple(os.path.abspath(v) for v in controller.config.get('opengnsys', 'path').split(','))
     else:
         paths = ()
-    
-    # paths += (os.path.dirname(sys.modules[modPath].__file__),)
 
     logger.debug('Loading modules from {}'.format(paths))
-    
-    # Load modules      
-    doLoad(paths)
-    
-    # Add to list of available modules
-    recursiveAdd(modType)
-    
+
+    # Own modules change with the agent (or its bundle), external ones whenever their files change
+    bundle = getBundle()
+    if bundle is not None:
+        ownSignature = [0, os.path.getmtime(bundle)]
+    else:
+        ownSignature = _treeSignature(os.path.dirname(sys.modules[modPath].__file__))
+    key = {
+        'version': MANIFEST_VERSION,
+        'python': list(sys.version_info[:2]),
+        'own': ownSignature,
+        'paths': [[path, _treeSignature(path)] for path in paths]
+    }
+    manifestFile = _manifestFile(modPath, client)
+    entries = _readManifest(manifestFile, key) if manifestFile is not None else None
+    if entries is None:
+        logger.debug('Scanning module packages')
+        entries = _scanModules(modPath, modType, paths)
+    elif any(entry.get('failed') for entry in entries):
+        logger.debug('Scanning module packages that failed to load')
+        entries = [entry for entry in entries if not entry.get('failed')] + \
+            _scanPackages([entry for entry in entries if entry.get('failed')], modType)
+    else:
+        manifestFile = None  # Up to date
+    if manifestFile is not None:
+        _writeManifest(manifestFile, key, entries)
+
+    def isEnabled(name):
+        if controller.config.has_option(name, 'enabled'):
+            return controller.config.getboolean(name, 'enabled')
+        return True
+
+    for entry in entries:
+        for name, module, clsName in entry['workers']:
+            if not isEnabled(name):
+                logger.info('Module {} is disabled'.format(name))
+                continue
+            try:
+                _loadPackage(entry['package'], entry['path'])
+                cls = getattr(importlib.import_module(module), clsName)
+                if not issubclass(cls, modType):
+                    raise TypeError('{} is not a module class'.format(cls))
+                ogModules.append(cls(controller))
+            except Exception as e:
+                logger.error('Error loading module {}'.format(e))
+
     return ogModules
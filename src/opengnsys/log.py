@@ -31,6 +31,11 @@
 '''
 from __future__ import unicode_literals
 
+import atexit
+import collections
+import os
+import threading
+import time
 import traceback
 import sys
 import six
@@ -51,11 +56,100 @@ _levelName = {
     'ERROR': ERROR,
     'FATAL': FATAL
 }
+_nameLevel = dict((v, k) for k, v in _levelName.items())
+_srcFile = os.path.normcase(sys._getframe().f_code.co_filename.rsplit('.', 1)[0])  # As compiled (also in bundle)
+
+QUEUE_SIZE = 10000  # Maximum number of messages waiting to be written, newer ones are dropped
+BATCH_SIZE = 256  # Maximum number of messages written at once
+FLUSH_TIMEOUT = 5  # Maximum time, in seconds, waiting for pending messages to be written on flush
+RECORDS_SIZE = 1000  # Last log records kept in memory
+LOG_MAXSIZE = '10M'  # Default size for rotating log file
+LOG_BACKUPS = 5  # Default number of rotated (compressed) log files kept
+
+_sizeUnits = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def _parseSize(size):
+    '''
+    Parses a size in bytes, with optional K, M or G suffix (i.e. 10M)
+    '''
+    size = six.text_type(size).strip().upper()
+    if size and size[-1] in _sizeUnits:
+        return int(float(size[:-1]) * _sizeUnits[size[-1]])
+    return int(size)
+
 
 class Logger(object):
+    '''
+    Messages are queued and written by a single background thread, so logging never waits for disk
+    Messages are only built if their level is enabled, so expensive ones should be passed with %-style arguments,
+    or as a callable returning the message:
+        logger.debug('Got message %s from %s', msg, address)
+        logger.debug(lambda: 'Pending: {}'.format(dumpQueue()))
+        if logger.isEnabledFor(DEBUG):
+            ...
+    '''
     def __init__(self):
         self.logLevel = INFO
         self.logger = LocalLogger()
+        self.queue = None
+        self.writer = None
+        self.pid = None
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.records = collections.deque(maxlen=RECORDS_SIZE)
+        atexit.register(self.flush)
+
+    def _getQueue(self):
+        '''
+        Returns messages queue, starting writer thread if not running in this process (threads don't survive fork)
+        '''
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.queue = six.moves.queue.Queue(QUEUE_SIZE)  # @UndefinedVariable
+                    self.writer = threading.Thread(target=self._write, args=(self.queue,), name='LogWriter')
+                    self.writer.daemon = True
+                    self.writer.start()
+                    self.pid = os.getpid()
+        return self.queue
+
+    def afterFork(self, rotate=False):
+        '''
+        Must be invoked on forked processes, as locks held by other threads when forking are never released there
+        Writer thread (and its queue) will be started again on first message
+        Log is only rotated by process that set up rotation, unless forked process takes it over with rotate=True
+        (i.e. daemonized service, as its parent process exits)
+        '''
+        self.lock = threading.Lock()
+        self.queue = self.writer = self.pid = None
+        self.logger.afterFork(rotate)
+
+    def _write(self, queue):
+        '''
+        Writer thread, writes queued messages in batches
+        '''
+        while True:
+            batch = [queue.get()]
+            try:
+                while len(batch) < BATCH_SIZE:
+                    batch.append(queue.get_nowait())
+            except six.moves.queue.Empty:  # @UndefinedVariable
+                pass
+
+            try:
+                with self.logger.batch():
+                    for level, message, created, threadName in batch:
+                        self.logger.log(level, message, created, threadName)
+                    with self.lock:
+                        dropped, self.dropped = self.dropped, 0
+                    if dropped:
+                        self.logger.log(WARN, '{} log messages dropped (log queue full)'.format(dropped))
+            except Exception:
+                pass  # Nowhere to log it
+            finally:
+                for _ in batch:
+                    queue.task_done()
 
     def setLevel(self, level):
         '''
@@ -67,28 +161,91 @@ class Logger(object):
             
         self.logLevel = level  # Ensures level is an integer or fails
 
-    def log(self, level, message):
+    def setRotation(self, maxSize=LOG_MAXSIZE, maxAge=None, backups=LOG_BACKUPS):
+        '''
+        Sets log file rotation (as read from configuration files)
+        :param maxSize: Log file is rotated when it reaches this size (i.e. 10M), 0 or empty to disable
+        :param maxAge: Log file is rotated when it's older than this number of days, 0 or empty to disable
+        :param backups: Rotated log files kept (compressed)
+        '''
+        try:
+            maxBytes = _parseSize(maxSize) if maxSize else None
+            maxAge = float(maxAge) * 86400 if maxAge else None
+            self.logger.setRotation(maxBytes, maxAge, int(backups))
+        except Exception as e:
+            self.error('Invalid log rotation settings: {}'.format(e))
+
+    def isEnabledFor(self, level):
+        return level >= self.logLevel
+
+    def log(self, level, message, *args):
         if level < self.logLevel:  # Skip not wanted messages
             return
 
-        self.logger.log(level, message)
+        if callable(message):
+            message = message()
+        elif args:
+            try:
+                message = message % args
+            except Exception:
+                message = '{} {}'.format(message, args)
+
+        created, threadName = time.time(), threading.current_thread().name
+        self.records.append((created, level, threadName, self._callerModule(), message))
+        try:
+            self._getQueue().put_nowait((level, message, created, threadName))
+        except six.moves.queue.Full:  # @UndefinedVariable
+            with self.lock:
+                self.dropped += 1
+
+    @staticmethod
+    def _callerModule():
+        '''
+        Returns name of module invoking logger
+        '''
+        frame = sys._getframe(1)  # pylint: disable=protected-access
+        while frame is not None and os.path.normcase(frame.f_code.co_filename.rsplit('.', 1)[0]) == _srcFile:
+            frame = frame.f_back
+        return frame.f_globals.get('__name__', '') if frame is not None else ''
+
+    def getRecords(self, since=None, level=None, module=None, limit=None):
+        '''
+        Returns last log records kept in memory, oldest first, as dicts (time, level, thread, module and message)
+        :param since: Only records logged after this timestamp
+        :param level: Only records with this level or above
+        :param module: Only records from this module (or its submodules)
+        :param limit: Maximum number of records returned (the newest ones)
+        '''
+        if isinstance(level, six.string_types):
+            level = _levelName.get(level.upper(), OTHER)
+        res = []
+        for created, lvl, threadName, mod, message in list(self.records):
+            if since is not None and created <= since or level is not None and lvl < level or \
+                    module is not None and mod != module and not mod.startswith(module + '.'):
+                continue
+            res.append({'time': created, 'level': _nameLevel.get(lvl, lvl), 'thread': threadName,
+                        'module': mod, 'message': message if isinstance(message, six.string_types) else
+                        '{}'.format(message)})
+        return res[-limit:] if limit else res
 
-    def debug(self, message):
-        self.log(DEBUG, message)
+    def debug(self, message, *args):
+        self.log(DEBUG, message, *args)
 
-    def warn(self, message):
-        self.log(WARN, message)
+    def warn(self, message, *args):
+        self.log(WARN, message, *args)
 
-    def info(self, message):
-        self.log(INFO, message)
+    def info(self, message, *args):
+        self.log(INFO, message, *args)
 
-    def error(self, message):
-        self.log(ERROR, message)
+    def error(self, message, *args):
+        self.log(ERROR, message, *args)
 
-    def fatal(self, message):
-        self.log(FATAL, message)
+    def fatal(self, message, *args):
+        self.log(FATAL, message, *args)
 
     def exception(self):
+        if not self.isEnabledFor(DEBUG):
+            return
         try:
             tb = traceback.format_exc()
         except Exception:
@@ -96,8 +253,20 @@ class Logger(object):
 
         self.log(DEBUG, tb)
 
-    def flush(self):
-        pass
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        '''
+        Waits (at most timeout seconds) until queued messages are written
+        '''
+        queue = self.queue
+        if queue is None or self.pid != os.getpid():
+            return
+        deadline = time.time() + timeout
+        with queue.all_tasks_done:
+            while queue.unfinished_tasks:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                queue.all_tasks_done.wait(remaining)
 
 
 logger = Logger()
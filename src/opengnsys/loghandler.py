@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Log file handling shared by platform specific local loggers
+"""
+from __future__ import unicode_literals
+
+import contextlib
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+
+LOG_FORMAT = '%(levelname)s %(asctime)s %(message)s'
+CHECK_INTERVAL = 1  # Seconds between checks for log file replaced by other process
+
+
+def _replace(src, dst):
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)  # Windows can't rename over an existing file
+    os.rename(src, dst)
+
+
+def compressFile(fileName):
+    """
+    Compresses fileName to fileName.gz, removing it
+    """
+    try:
+        with open(fileName, 'rb') as src:
+            dst = gzip.open(fileName + '.gz.tmp', 'wb')
+            try:
+                shutil.copyfileobj(src, dst)
+            finally:
+                dst.close()
+        os.chmod(fileName + '.gz.tmp', 0o0600)
+        _replace(fileName + '.gz.tmp', fileName + '.gz')
+        os.remove(fileName)
+    except Exception:
+        pass  # Rotated file is just kept uncompressed
+
+
+class DeferredFileHandler(logging.FileHandler):
+    """
+    File handler that can write a batch of records with a single flush
+    Records emitted outside of a batch (i.e. by third party libs) are flushed as usual
+    File is rotated when it reaches maxBytes or it is older than maxAge seconds (if set). Rotated files are named
+    as file.1.gz (newest), file.2.gz, ... and compressed on background, keeping just backupCount of them.
+    Forked processes sharing the file don't rotate it, they just reopen it once rotated.
+    """
+    def __init__(self, *args, **kwargs):
+        logging.FileHandler.__init__(self, *args, **kwargs)
+        self.deferred = threading.local()
+        self.maxBytes = self.maxAge = None
+        self.backupCount = 0
+        self.rolloverAt = None
+        self.pid = None  # Process rotating the file
+        self.checkAt = 0
+        self.compressor = None
+
+    def fileStarted(self):
+        """
+        Returns when current log file was started: time of its first record, or its modification time if it can't be
+        parsed (or now, if file is empty)
+        """
+        try:
+            with open(self.baseFilename, 'r') as f:
+                line = f.readline()
+            if not line:
+                return time.time()
+            try:
+                return time.mktime(time.strptime(' '.join(line.split(' ', 3)[1:3]).split(',')[0],
+                                                 '%Y-%m-%d %H:%M:%S'))
+            except ValueError:
+                return os.path.getmtime(self.baseFilename)
+        except (IOError, OSError):
+            return time.time()
+
+    def setRotation(self, maxBytes=None, maxAge=None, backupCount=0):
+        self.acquire()
+        try:
+            self.maxBytes, self.maxAge, self.backupCount = maxBytes, maxAge, backupCount
+            # Age is counted since file was started, not since agent was, as it may be restarted every day
+            self.rolloverAt = self.fileStarted() + maxAge if maxAge else None
+            self.claimRotation()
+        finally:
+            self.release()
+
+    def claimRotation(self):
+        """
+        Makes current process the one rotating the log (other processes sharing it just reopen it once rotated)
+        """
+        self.pid = os.getpid()
+
+    def _reopenIfMoved(self):
+        """
+        Other process (sharing the log file) could have rotated it
+        """
+        now = time.time()
+        if self.stream is None or now < self.checkAt:
+            return
+        self.checkAt = now + CHECK_INTERVAL
+        try:
+            moved = os.fstat(self.stream.fileno()).st_ino != os.stat(self.baseFilename).st_ino
+        except OSError:
+            moved = True
+        if moved:
+            self.stream.close()
+            self.stream = self._open()
+
+    def shouldRollover(self):
+        if self.stream is None:
+            return False
+        if self.rolloverAt is not None and time.time() >= self.rolloverAt:
+            return True
+        if self.maxBytes:
+            self.stream.seek(0, 2)  # Append mode, but position is not updated until next write
+            return self.stream.tell() >= self.maxBytes
+        return False
+
+    def doRollover(self):
+        self.stream.close()
+        self.stream = None
+        if self.compressor is not None:
+            self.compressor.join()  # Previous rotated file must be already compressed, as it's going to be renamed
+        if self.backupCount > 0:
+            for ext in ('', '.gz'):
+                oldest = '{}.{}{}'.format(self.baseFilename, self.backupCount, ext)
+                if os.path.exists(oldest):
+                    os.remove(oldest)
+            for i in range(self.backupCount - 1, 0, -1):
+                for ext in ('', '.gz'):
+                    src = '{}.{}{}'.format(self.baseFilename, i, ext)
+                    if os.path.exists(src):
+                        _replace(src, '{}.{}{}'.format(self.baseFilename, i + 1, ext))
+            rotated = self.baseFilename + '.1'
+            _replace(self.baseFilename, rotated)
+            self.compressor = threading.Thread(target=compressFile, args=(rotated,))
+            self.compressor.daemon = True
+            self.compressor.start()
+        else:
+            os.remove(self.baseFilename)
+        self.stream = self._open()
+        os.chmod(self.baseFilename, 0o0600)
+        if self.maxAge:
+            self.rolloverAt = time.time() + self.maxAge
+
+    def emit(self, record):
+        if self.maxBytes or self.maxAge:
+            try:
+                self._reopenIfMoved()
+                if self.pid == os.getpid() and self.shouldRollover():
+                    self.doRollover()
+            except Exception:
+                if self.stream is None:
+                    self.stream = self._open()
+        logging.FileHandler.emit(self, record)
+
+    def flush(self):
+        if not getattr(self.deferred, 'active', False):
+            logging.FileHandler.flush(self)
+
+    @contextlib.contextmanager
+    def batch(self):
+        self.deferred.active = True
+        try:
+            yield
+        finally:
+            self.deferred.active = False
+            self.flush()
+
+
+def createFileLogger(fileName, mode=None):
+    """
+    Sets up root logger to write to fileName (as logging.basicConfig does), returning "opengnsys" logger and its handler
+    If root logger already writes to fileName, its handler is reused
+    Raises an exception if file can't be opened (or its mode, if provided, can't be set)
+    """
+    root = logging.getLogger()
+    fileName = os.path.abspath(fileName)
+    for handler in root.handlers:
+        if isinstance(handler, DeferredFileHandler) and handler.baseFilename == fileName:
+            return logging.getLogger('opengnsys'), handler
+    handler = DeferredFileHandler(fileName, 'a')
+    try:
+        if mode is not None:
+            os.chmod(fileName, mode)
+    except Exception:
+        handler.close()
+        raise
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+    return logging.getLogger('opengnsys'), handler
+
+
+def logRecord(logger, level, message, created=None, threadName=None):
+    """
+    Logs a message, keeping the time and thread where it was produced (if provided)
+    @param level: logging level (not opengnsys one)
+    """
+    if not logger.isEnabledFor(level):
+        return
+    record = logger.makeRecord(logger.name, level, '(unknown file)', 0, message, (), None)
+    if created is not None:
+        record.relativeCreated += (created - record.created) * 1000
+        record.created = created
+        record.msecs = (created - int(created)) * 1000
+    if threadName is not None:
+        record.threadName = threadName
+    logger.handle(record)
+
+
+@contextlib.contextmanager
+def noBatch():
+    yield
@@ -233,6 +233,13 @@ def getIdleDuration():
     return info.contents.idle / 1000.0
 
 
+def closeIdleDuration():
+    '''
+    Nothing is kept open to get idle duration
+    '''
+    pass
+
+
 def getCurrentUser():
     '''
     Returns current logged in user
@@ -261,3 +268,18 @@ def get_etc_path():
     Returns etc directory path.
     """
     return os.sep + 'etc'
+
+
+def get_state_path():
+    """
+    :return:
+    Returns directory path for agent state kept across restarts (only accessible by agent).
+    """
+    return os.path.join(os.sep, 'var', 'db', 'ogagent')
+
+
+def initThread():
+    '''
+    Prepares a thread (other than main one) for using operations, nothing is needed here
+    '''
+    pass
@@ -32,7 +32,6 @@ from __future__ import unicode_literals
 
 import threading
 import os
-import platform
 import time
 import random
 import shutil
@@ -42,6 +41,12 @@ import urllib
 from opengnsys.workers import ServerWorker
 from opengnsys import REST, RESTError
 from opengnsys import operations
+from opengnsys import utils
+from opengnsys.hostinfo import hostInfo
+from opengnsys.httpserver import CachedResponse, getBulkheadStats
+from opengnsys.notifier import Notifier
+from opengnsys.outbox import Outbox
+from opengnsys.retry import RetryPolicy
 from opengnsys.log import logger
 from opengnsys.scriptThread import ScriptExecutorThread
 
@@ -55,7 +60,7 @@ def check_secret(fnc):
         try:
             this, path, get_params, post_params, server = args  # @UnusedVariable
             if this.random == server.headers['Authorization']:
-                fnc(*args, **kwargs)
+                return fnc(*args, **kwargs)
             else:
                 raise Exception('Unauthorized operation')
         except Exception as e:
@@ -80,61 +85,122 @@ class OpenGnSysWorker(ServerWorker):
     name = 'opengnsys'
     interface = None  # Bound interface for OpenGnsys
     REST = None  # REST object
+    notifier = None  # Background sender for notifications to OpenGnsys server
     logged_in = False  # User session flag
     session_type = ''  # User session type
     locked = {}
+    os_status = None  # Status code depending on OS, it does not change while running
+    status = None  # Pre-serialized status response, updated on every login or logout, and when lock state changes
+    status_busy = False  # Lock state of pre-serialized status response
+    status_lock = threading.Lock()  # Status response is updated from dispatcher and HTTP threads
     random = None  # Random string for secure connections
     length = 32  # Random string length
+    pool_size = 4  # Kept alive connections to OpenGnsys server
+    alt_index = None  # Position of alternative server on servers list, if defined
+    outbox_file = 'outbox.journal'  # Default file (on state dir) for not yet delivered notifications
+    bulk_message = None  # Server method receiving several notifications at once, if supported (see configuration)
+    interface_timeout = 300  # Seconds waiting for an active network interface
+    network_ready = None  # Set by network watcher when an interface is available
+    registered = False  # Activation notification has been sent
+    registering = None  # Thread sending activation notification again (after an IP change)
+    started_policy = RetryPolicy(base=1, cap=60, deadline=900)  # Retrying activation notification to server
+    activationTimeout = 1260  # Waiting for network interface plus retrying activation notification, with some margin
+    maxConcurrent = 4  # Requests (not status ones) processed at once
+    maxQueued = 8
+    routeLimits = {'status': (8, 32)}  # Status is cheap, it must not wait for slow operations
+
+    def get_os_status(self):
+        """
+        Returns status code for running OS (GNU/Linux, OpenGnsys Client, Windows or Mac OS X)
+        """
+        system = hostInfo.get('osType')
+        if system == 'Linux':        # GNU/Linux
+            # Check if it's OpenGnsys Client.
+            if os.path.exists('/scripts/oginit'):
+                return 'OPG'
+            return 'LNX'
+        elif system == 'Windows':    # Windows
+            return 'WIN'
+        elif system == 'MacOS':      # Mac OS X  ??
+            return 'OSX'
+        return ''
+
+    def update_status(self):
+        """
+        Builds status response, so it's serialized just once per change instead of on every status request
+        """
+        # State is read and response replaced at once, so a thread can't overwrite a newer response with an older one
+        with self.status_lock:
+            if self.os_status is None:
+                self.os_status = self.get_os_status()
+            res = {'status': self.os_status, 'loggedin': self.logged_in, 'session': self.session_type}
+            # Check if OpenGnsys Client is busy.
+            self.status_busy = self.is_busy()
+            if self.status_busy:
+                res['status'] = 'BSY'
+            self.status = CachedResponse(res)
+
+    def is_busy(self):
+        return self.os_status == 'OPG' and bool(self.locked)
 
     def onActivation(self):
         """
         Sends OGAgent activation notification to OpenGnsys server
         """
-        t = 0
+        self.update_status()
         # Generate random secret to send on activation
         self.random = ''.join(random.choice(string.ascii_lowercase + string.digits) for _ in range(self.length))
         # Ensure cfg has required configuration variables or an exception will be thrown
-        url = self.service.config.get('opengnsys', 'remote')
-        self.REST = REST(url)
-        # Get network interfaces until they are active or timeout (5 minutes)
-        for t in range(0, 300):
+        urls = self.service.config.get('opengnsys', 'remote').split(',')
+        # Alternative server, if defined (used in "exam mode" from the University of Seville)
+        if self.service.config.has_option('opengnsys', 'altremote'):
+            self.alt_index = len(urls)
+            urls.append(self.service.config.get('opengnsys', 'altremote'))
+        if self.service.config.has_option('opengnsys', 'pool_size'):
+            self.pool_size = self.service.config.getint('opengnsys', 'pool_size')
+        self.REST = REST([u.strip() for u in urls], self.pool_size)
+        # Session notifications are queued (and stored, so they are not lost if server is unreachable) from now on
+        if self.service.config.has_option('opengnsys', 'outbox'):
+            outbox_path = self.service.config.get('opengnsys', 'outbox')
+        else:
+            outbox_path = os.path.join(operations.get_state_path(), self.outbox_file)
+        try:
+            utils.makePrivateDir(os.path.dirname(os.path.abspath(outbox_path)))
+            outbox = Outbox(outbox_path)
+        except Exception as e:
+            logger.error('Session notifications will not be kept until delivered: {}'.format(e))
+            outbox = None
+        if self.service.config.has_option('opengnsys', 'bulk'):
+            self.bulk_message = self.service.config.get('opengnsys', 'bulk') or None
+        self.notifier = Notifier(self.REST, outbox, bulkMessage=self.bulk_message)
+        # Wait for an active network interface (notified by network watcher) or timeout (5 minutes)
+        self.network_ready = threading.Event()
+        hostInfo.refresh('network')
+        interfaces = hostInfo.get('network')
+        if not interfaces:
+            logger.debug('Waiting for an active network interface')
+            if not self.network_ready.wait(self.interface_timeout):
+                raise Exception('Initialization error: No active network interface')
+            interfaces = hostInfo.get('network')  # Already updated by network watcher
+        self.interface = interfaces[0]  # Get first network interface
+        # Loop to send initialization message, backing off so a whole lab starting at once does not flood server
+        for t in self.started_policy.attempts():
             try:
-                self.interface = list(operations.getNetworkInfo())[0]  # Get first network interface
+                self.send_started()
+                break
             except Exception as e:
-                # Wait 1 sec. and retry
-                time.sleep(1)
-            finally:
-                # Exit loop if interface is active
-                if self.interface:
-                    if t > 0:
-                        logger.debug("Fetch connection data after {} tries".format(t))
-                    break
-        # Raise error after timeout
-        if not self.interface:
-            raise e
-        # Loop to send initialization message
-        for t in range(0, 100):
-            try:
-                try:
-                    self.REST.sendMessage('ogagent/started', {'mac': self.interface.mac, 'ip': self.interface.ip,
-                                                              'secret': self.random, 'ostype': operations.os_type,
-                                                              'osversion': operations.os_version})
-                    break
-                except:
-                    # Trying to initialize on alternative server, if defined
-                    # (used in "exam mode" from the University of Seville)
-                    self.REST = REST(self.service.config.get('opengnsys', 'altremote'))
-                    self.REST.sendMessage('ogagent/started', {'mac': self.interface.mac, 'ip': self.interface.ip,
-                                                              'secret': self.random, 'ostype': operations.os_type,
-                                                              'osversion': operations.os_version, 'alt_url': True})
-                    break
-            except:
-                time.sleep(3)
-        # Raise error after timeout
-        if 0 < t < 100:
-            logger.debug('Successful connection after {} tries'.format(t))
-        elif t == 100:
+                logger.debug('Could not connect to remote server: {}'.format(e))
+        else:
+            # Raise error after timeout
             raise Exception('Initialization error: Cannot connect to remote server')
+        if t > 0:
+            logger.debug('Successful connection after {} tries'.format(t))
+        self.registered = True
+        # Session notifications left by previous runs (if server was unreachable) are outdated by this activation
+        # (i.e. a login from a previous boot would show a user no longer logged in)
+        self.notifier.discardRestored('session')
+        # Session notifications are sent in background from now on
+        self.notifier.start()
         # Delete marking files
         for f in ['ogboot.me', 'ogboot.firstboot', 'ogboot.secondboot']:
             try:
@@ -148,13 +214,69 @@ class OpenGnSysWorker(ServerWorker):
         if os.path.isfile(new_hosts_file):
             shutil.copyfile(new_hosts_file, hosts_file)
 
+    def send_started(self):
+        """
+        Sends activation notification to the healthiest server that can be reached (just to one of them)
+        If it is the alternative server, it is told so (alt_url), as it may behave differently (i.e. "exam mode")
+        """
+        error = None
+        for endpoint in self.REST.getEndpoints():
+            data = {'mac': self.interface.mac, 'ip': self.interface.ip, 'secret': self.random,
+                    'ostype': hostInfo.get('osType'), 'osversion': hostInfo.get('osVersion')}
+            if endpoint.index == self.alt_index:
+                data['alt_url'] = True
+            try:
+                return self.REST.sendMessage('ogagent/started', data, endpoint=endpoint)
+            except RESTError as e:
+                error = e
+        raise error
+
+    def onNetworkChange(self, interfaces):
+        """
+        Wakes up activation when an interface becomes active, and registers again on OpenGnsys server if IP changes
+        """
+        if not interfaces:
+            return
+        if self.network_ready is not None:
+            self.network_ready.set()
+        if not self.registered or self.interface is None:
+            return
+        # Keep using same interface, if present
+        interface = next((i for i in interfaces if i.mac == self.interface.mac), interfaces[0])
+        if interface == self.interface:
+            return
+        logger.info('Network address changed from {} to {}, registering again'.format(self.interface.ip,
+                                                                                       interface.ip))
+        self.interface = interface
+        if self.registering is None or not self.registering.is_alive():
+            self.registering = threading.Thread(target=self.register_again)
+            self.registering.daemon = True
+            self.registering.start()
+
+    def register_again(self):
+        """
+        Sends activation notification with current address, retrying with backoff
+        """
+        try:
+            while True:
+                interface = self.interface
+                self.started_policy.run(self.send_started)
+                if interface is self.interface:  # Address has not changed again while registering
+                    break
+        except Exception as e:
+            logger.error('Could not register new address on OpenGnsys server: {}'.format(e))
+
     def onDeactivation(self):
         """
         Sends OGAgent stopping notification to OpenGnsys server
         """
         logger.debug('onDeactivation')
-        self.REST.sendMessage('ogagent/stopped', {'mac': self.interface.mac, 'ip': self.interface.ip,
-                                                  'ostype': operations.os_type, 'osversion': operations.os_version})
+        # Sent after pending session notifications. If server is unreachable, it will be sent on next start
+        self.notifier.notify('ogagent/stopped', {'mac': self.interface.mac, 'ip': self.interface.ip,
+                                                 'ostype': hostInfo.get('osType'),
+                                                 'osversion': hostInfo.get('osVersion')},
+                             key='session', durable=True)
+        self.notifier.stop()
 
     def processClientMessage(self, message, data):
         logger.debug('Got OpenGnsys message from client: {}, data {}'.format(message, data))
@@ -166,9 +288,12 @@ class OpenGnSysWorker(ServerWorker):
         user, language, self.session_type = tuple(data.split(','))
         logger.debug('Received login for {0} using {2} with language {1}'.format(user, language, self.session_type))
         self.logged_in = True
-        self.REST.sendMessage('ogagent/loggedin', {'ip': self.interface.ip, 'user': user, 'language': language,
-                                                   'session': self.session_type,
-                                                   'ostype': operations.os_type, 'osversion': operations.os_version})
+        self.update_status()
+        # Login and logout share key, so they are sent in order
+        self.notifier.notify('ogagent/loggedin', {'ip': self.interface.ip, 'user': user, 'language': language,
+                                                  'session': self.session_type, 'ostype': hostInfo.get('osType'),
+                                                  'osversion': hostInfo.get('osVersion')},
+                             key='session', durable=True)
 
     def onLogout(self, user):
         """
@@ -176,7 +301,9 @@ class OpenGnSysWorker(ServerWorker):
         """
         logger.debug('Received logout for {}'.format(user))
         self.logged_in = False
-        self.REST.sendMessage('ogagent/loggedout', {'ip': self.interface.ip, 'user': user})
+        self.update_status()
+        self.notifier.notify('ogagent/loggedout', {'ip': self.interface.ip, 'user': user}, key='session',
+                             durable=True)
 
     def process_ogclient(self, path, get_params, post_params, server):
         """
@@ -209,30 +336,17 @@ class OpenGnSysWorker(ServerWorker):
     def process_status(self, path, get_params, post_params, server):
         """
         Returns client status (OS type or execution status) and login status
+        Response is pre-serialized and tagged, so unchanged status is answered with "304 Not Modified"
         :param path:
         :param get_params:
         :param post_params:
         :param server:
         :return: JSON object {"status": "status_code", "loggedin": boolean}
         """
-        res = {'status': '', 'loggedin': self.logged_in, 'session': self.session_type}
-        if platform.system() == 'Linux':        # GNU/Linux
-            # Check if it's OpenGnsys Client.
-            if os.path.exists('/scripts/oginit'):
-                # Check if OpenGnsys Client is busy.
-                if self.locked:
-                    res['status'] = 'BSY'
-                else:
-                    res['status'] = 'OPG'
-            else:
-                # Check if there is an active session.
-                res['status'] = 'LNX'
-        elif platform.system() == 'Windows':    # Windows
-            # Check if there is an active session.
-            res['status'] = 'WIN'
-        elif platform.system() == 'Darwin':     # Mac OS X  ??
-            res['status'] = 'OSX'
-        return res
+        # Lock changes are not notified (locked dict can be modified in place), so they are checked here
+        if self.status is None or self.is_busy() != self.status_busy:
+            self.update_status()
+        return self.status
 
     @check_secret
     def process_reboot(self, path, get_params, post_params, server):
@@ -284,7 +398,7 @@ class OpenGnSysWorker(ServerWorker):
         logger.debug('Processing script request')
         # Decoding script (Windows scripts need a subprocess call per line)
         script = urllib.unquote(post_params.get('script').decode('base64')).decode('utf8')
-        if operations.os_type == 'Windows':
+        if hostInfo.get('osType') == 'Windows':
             script = 'import subprocess; {0}'.format(
                 ';'.join(['subprocess.check_output({0},shell=True)'.format(repr(c)) for c in script.split('\n')]))
         else:
@@ -317,5 +431,45 @@ class OpenGnSysWorker(ServerWorker):
         self.sendClientMessage('popup', post_params)
         return {'op': 'launched'}
 
+    @check_secret
+    def process_logs(self, path, get_params, post_params, server):
+        """
+        Returns last log records kept in memory (no disk access), oldest first
+        Optional GET parameters: since (timestamp), level (minimum level), module (name) and limit (number of records)
+        :param path:
+        :param get_params: filters
+        :param post_params:
+        :param server: authorization header
+        :return: JSON object {"records": [{"time": timestamp, "level": "level", "thread": "thread", "module": "module",
+                                           "message": "message"}, ...]}
+        """
+        since = get_params.get('since')
+        limit = get_params.get('limit')
+        return {'records': logger.getRecords(since=float(since) if since else None, level=get_params.get('level'),
+                                             module=get_params.get('module'), limit=int(limit) if limit else None)}
+
+    @check_secret
+    def process_diagnostics(self, path, get_params, post_params, server):
+        """
+        Returns timings of last requests sent to OpenGnsys server, servers health, pending notifications,
+        events queued to modules and requests being processed by modules
+        :param path:
+        :param get_params:
+        :param post_params:
+        :param server: authorization header
+        :return: JSON object {"requests": [...], "summary": {...}, "servers": [...], "notifications": {...},
+                              "events": {...}, "requests_limits": {...}}
+        """
+        logger.debug('Received diagnostics operation')
+        res = {'requests': self.REST.tracer.getTraces(), 'summary': self.REST.tracer.summary(),
+               'servers': [e.asDict() for e in self.REST.getEndpoints()]}
+        if self.notifier is not None:
+            res['notifications'] = {'queued': self.notifier.queued, 'dropped': self.notifier.dropped,
+                                    'failures': self.notifier.failures}
+        if getattr(self.service, 'dispatcher', None) is not None:
+            res['events'] = self.service.dispatcher.getStats()
+        res['requests_limits'] = getBulkheadStats()
+        return res
+
     def process_client_popup(self, params):
-        self.REST.sendMessage('popup_done', params)
+        self.notifier.notify('popup_done', params)
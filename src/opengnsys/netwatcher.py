@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Watches network interfaces, notifying changes (interfaces or addresses added, removed or changed)
+"""
+from __future__ import unicode_literals
+
+import select
+import socket
+import sys
+import threading
+import time
+
+from . import operations
+from .log import logger
+from .utils import exceptionToMessage
+
+POLL_INTERVAL = 5  # Seconds between checks on platforms without change notifications
+SETTLE_TIME = 0.5  # Seconds waiting for related changes (i.e. link up and its address) to be notified together
+STOP_CHECK = 1  # Seconds between checks for stop request while waiting for kernel notifications
+
+
+class NetworkWatcher(threading.Thread):
+    """
+    Invokes callback(interfaces) with the result of operations.getNetworkInfo every time it changes
+    On Linux, changes are notified by kernel (rtnetlink link and IPv4 address groups), on other platforms
+    network info is polled every POLL_INTERVAL seconds.
+    """
+    def __init__(self, callback, interval=POLL_INTERVAL):
+        super(NetworkWatcher, self).__init__()
+        self.daemon = True
+        self.callback = callback
+        self.interval = interval
+        self.stopEvent = threading.Event()
+        self.interfaces = self.getInterfaces()
+
+    @staticmethod
+    def getInterfaces():
+        try:
+            return list(operations.getNetworkInfo())
+        except Exception as e:
+            logger.debug('Could not get network interfaces: %s', exceptionToMessage(e))
+            return []
+
+    def stop(self):
+        self.stopEvent.set()
+
+    def check(self):
+        """
+        Gets network info, invoking callback if it has changed
+        """
+        interfaces = self.getInterfaces()
+        if interfaces == self.interfaces:
+            return
+        logger.info('Network interfaces changed: {}'.format(
+            ', '.join('{} {} {}'.format(i.name, i.mac, i.ip) for i in interfaces) or 'none'))
+        self.interfaces = interfaces
+        try:
+            self.callback(interfaces)
+        except Exception as e:
+            logger.error('Error processing network change: {}'.format(exceptionToMessage(e)))
+
+    def _openNetlink(self):
+        if not sys.platform.startswith('linux'):
+            return None
+        from .linux import netlink
+        try:
+            return netlink.openSocket(netlink.RTMGRP_LINK | netlink.RTMGRP_IPV4_IFADDR)
+        except Exception as e:
+            logger.warn('Network changes can\'t be watched ({}), polling them'.format(exceptionToMessage(e)))
+            return None
+
+    def _drain(self, sock, timeout):
+        """
+        Waits for kernel notifications, returning True if any was received
+        """
+        received = False
+        while select.select([sock], [], [], timeout)[0]:
+            try:
+                sock.recv(65536)
+            except socket.error:
+                pass  # Notifications lost (buffer overrun), network info will be checked anyway
+            received = True
+            timeout = 0
+        return received
+
+    def run(self):
+        operations.initThread()
+        sock = self._openNetlink()
+        try:
+            # Changes between construction and now are not missed
+            self.check()
+            while not self.stopEvent.is_set():
+                if sock is None:
+                    self.stopEvent.wait(self.interval)
+                elif not self._drain(sock, STOP_CHECK):
+                    continue
+                else:
+                    # Let related changes arrive before checking
+                    time.sleep(SETTLE_TIME)
+                    self._drain(sock, 0)
+                if not self.stopEvent.is_set():
+                    self.check()
+        except Exception as e:
+            logger.error('Network watcher stopped: {}'.format(exceptionToMessage(e)))
+        finally:
+            if sock is not None:
+                sock.close()
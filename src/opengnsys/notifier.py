@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Background sender for notifications to remote REST servers
+"""
+from __future__ import unicode_literals
+
+import threading
+import time
+import collections
+
+from .log import logger
+from .RESTApi import ConnectionError, InvalidResponseError, RejectedError, UnsupportedError
+from .retry import RetryPolicy
+from .utils import exceptionToMessage
+
+MAX_QUEUED = 256  # Maximum number of notifications waiting to be sent (but durable ones, limited by outbox)
+MAX_RETRIES = 10  # Maximum send retries for a notification before discarding it (see Notifier)
+RETRY_DELAY = 3  # Base delay, in seconds, before retrying after a failure (doubled on consecutive failures)
+MAX_RETRY_DELAY = 60  # Maximum delay between retries, in seconds
+STOP_TIMEOUT = 10  # Time, in seconds, used to send pending notifications on stop
+BATCH_SIZE = 32  # Maximum number of notifications sent together on a bulk message
+BATCH_WINDOW = 0.5  # Time, in seconds, waiting for more notifications before sending a bulk message
+
+
+class Notifier(threading.Thread):
+    """
+    Sends notifications to a REST server on its own thread, so producers return immediately.
+    Notifications are grouped by key (by default, the message itself). Notifications with same key are sent in
+    order, keys are served in turns.
+    Once a notification fails, server is considered unreachable and just one notification is tried on every
+    retry period (given by retryPolicy, jittered exponential backoff by default). As soon as one succeeds, every
+    pending notification is flushed.
+    Durable notifications are also kept on an outbox (if provided), so they are sent again after a restart, and
+    they are not discarded while server is unreachable, however long it takes.
+    Notifications rejected by server (HTTP 4xx status) are discarded, as sending them again would not help. So are
+    the ones failing maxRetries times while server answers, but with an invalid response, so they don't hold back
+    the rest forever.
+    If a bulk message is provided, notifications produced within batchWindow seconds are coalesced (up to batchSize)
+    and sent together, as {"events": [{"message": message, "data": data}, ...]}. If server does not support bulk
+    message, notifications are sent one by one.
+    Examples:
+       n = Notifier(REST('https://example.com/rest/v1/'), Outbox('/var/lib/example/outbox'))
+       n.start()
+       n.notify('hello', {'name': 'mario'})
+       n.notify('loggedin', {'user': 'mario'}, key='session', durable=True)  # Login and logout share key
+       n = Notifier(REST('https://example.com/rest/v1/'), bulkMessage='events')  # Bursts are sent together
+    """
+    def __init__(self, rest, outbox=None, retryPolicy=None, maxQueued=MAX_QUEUED, maxRetries=MAX_RETRIES,
+                 bulkMessage=None, batchSize=BATCH_SIZE, batchWindow=BATCH_WINDOW):
+        super(Notifier, self).__init__()
+        self.daemon = True
+        self.rest = rest
+        self.outbox = outbox
+        self.retryPolicy = retryPolicy or RetryPolicy(base=RETRY_DELAY, cap=MAX_RETRY_DELAY)
+        self.maxQueued = maxQueued
+        self.maxRetries = maxRetries
+        self.bulkMessage = bulkMessage
+        self.batchSize = batchSize
+        self.batchWindow = batchWindow
+        self.queues = collections.OrderedDict()
+        self.queued = 0
+        self.volatile = 0  # Queued notifications not kept on outbox (the ones limited by maxQueued)
+        self.dropped = 0
+        self.failures = 0  # Consecutive failures
+        self.retryAt = 0
+        self.cond = threading.Condition()
+        self.running = True
+        self.deadline = None
+        self.restored = set()  # Ids of notifications loaded from outbox (left by previous runs)
+
+        if outbox is not None:
+            for record in outbox.items():
+                self.enqueue(record['key'], [record['message'], record['data'], 0, record['id']])
+                self.restored.add(record['id'])
+
+    def enqueue(self, key, notification):
+        self.queues.setdefault(key, collections.deque()).append(notification)
+        self.queued += 1
+        if notification[3] is None:
+            self.volatile += 1
+
+    def discard(self, key, notification):
+        """
+        Removes a notification from queues (and outbox), if it has not been already removed
+        Must be invoked with the condition acquired
+        """
+        queue = self.queues.get(key)
+        if not queue or notification not in queue:
+            return
+        queue.remove(notification)
+        self.queued -= 1
+        if not queue:
+            del self.queues[key]
+        if notification[3] is not None:
+            self.outbox.ack(notification[3])
+        else:
+            self.volatile -= 1
+
+    def discardRestored(self, key):
+        """
+        Discards pending notifications with key loaded from outbox, as they are outdated (i.e. by a new activation)
+        Notifications with key produced by this run are kept
+        @return: number of discarded notifications
+        """
+        with self.cond:
+            outdated = [n for n in self.queues.get(key, ()) if n[3] in self.restored]
+            for notification in outdated:
+                logger.info('Discarding notification {} left by previous run, data: {}'.format(notification[0],
+                                                                                                notification[1]))
+                self.discard(key, notification)
+            return len(outdated)
+
+    def notify(self, message, data=None, key=None, durable=False):
+        """
+        Queues a notification to be sent as soon as possible
+        If queue is full, the oldest notification with same key is discarded, if any. Durable notifications (if there
+        is an outbox) are not limited by queue size, but by outbox one.
+        @param message: Message (REST method) to send
+        @param data: Data to send, as in REST.sendMessage
+        @param key: Notifications with same key are sent in order. If omitted, message is used as key
+        @param durable: If True and there is an outbox, notification is stored until it's delivered
+        @return: False if notification could not be queued
+        """
+        key = key or message
+        durable = durable and self.outbox is not None
+        with self.cond:
+            if not durable and self.volatile >= self.maxQueued:
+                self.dropped += 1
+                oldest = next((n for n in self.queues.get(key, ()) if n[3] is None), None)
+                if oldest is None:
+                    logger.error('Notification queue is full, discarding {}'.format(message))
+                    return False
+                logger.error('Notification queue is full, discarding {}'.format(oldest[0]))
+                self.discard(key, oldest)
+
+            notificationId = None
+            if durable:
+                notificationId, discarded = self.outbox.append(key, message, data)
+                if discarded is not None:
+                    self.dropped += 1
+                    for k, queue in self.queues.items():
+                        for notification in queue:
+                            if notification[3] == discarded:
+                                self.discard(k, notification)
+                                break
+            self.enqueue(key, [message, data, 0, notificationId])
+            self.cond.notify()
+        return True
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Stops the sender, trying to send pending notifications for at most timeout seconds
+        """
+        with self.cond:
+            self.running = False
+            self.deadline = time.time() + timeout
+            self.cond.notify()
+        if self.is_alive():
+            self.join(timeout + 1)
+
+    def batchLimit(self):
+        """
+        Notifications that can be sent together. Just one while server is failing, or if there is no bulk message
+        """
+        return self.batchSize if self.bulkMessage and not self.failures else 1
+
+    def nextBatch(self, wait=True):
+        """
+        Waits for notifications ready to be sent and returns a list of (key, notification), or None if stopped
+        Notifications of every key are taken in order, keys are served in turns.
+        Must be invoked with the condition acquired
+        """
+        windowEnd = None
+        while True:
+            now = time.time()
+            if not self.running and (self.queued == 0 or now >= self.deadline):
+                return None
+            if self.queues and self.retryAt <= now:
+                limit = self.batchLimit()
+                if wait and self.running and self.queued < limit:  # Wait a bit for more notifications
+                    windowEnd = windowEnd or now + self.batchWindow
+                    if now < windowEnd:
+                        self.cond.wait(windowEnd - now)
+                        continue
+                batch = []
+                keys = list(self.queues.keys())
+                for position in range(limit):
+                    batch.extend((key, self.queues[key][position]) for key in keys if len(self.queues[key]) > position)
+                    if len(batch) >= limit:
+                        break
+                # Move first key to the end, so keys are served in turns
+                key, queue = self.queues.popitem(last=False)
+                self.queues[key] = queue
+                return batch[:limit]
+            if not wait:
+                return None
+            timeout = None if not self.queues else self.retryAt - now
+            if not self.running:
+                timeout = min(timeout, self.deadline - now) if timeout is not None else self.deadline - now
+            self.cond.wait(timeout)
+
+    def sendBatch(self, batch):
+        """
+        Sends notifications (as a bulk message if there is more than one), updating queues (and server
+        reachability) with the result
+        """
+        if len(batch) == 1:
+            message, data = batch[0][1][0], batch[0][1][1]
+        else:
+            message = self.bulkMessage
+            data = {'events': [{'message': n[0], 'data': n[1]} for _, n in batch]}
+        try:
+            self.rest.sendMessage(message, data)
+            error = None
+        except Exception as e:
+            if isinstance(e, RejectedError) and len(batch) > 1:
+                if isinstance(e, UnsupportedError):
+                    logger.info('Server does not support bulk message {}, sending notifications one by one'.format(
+                        message))
+                    with self.cond:
+                        self.bulkMessage = None
+                else:
+                    # One of them could be the culprit, so they are tried on their own (rejected ones are discarded)
+                    logger.warn('Server has rejected bulk message {}: {}'.format(message, exceptionToMessage(e)))
+                return self.sendBatch(batch[:1])
+            error = e
+            logger.warn('Could not send notification {}: {}'.format(message, exceptionToMessage(e)))
+
+        if error is not None and not isinstance(error, ConnectionError):
+            # Server has rejected them (or they can't be sent at all), there is no point in retrying
+            with self.cond:
+                for key, notification in batch:
+                    logger.error('Discarding notification {} rejected by server, data: {}'.format(
+                        notification[0], notification[1]))
+                    self.dropped += 1
+                    self.discard(key, notification)
+                self.failures = 0  # Server is reachable
+                self.retryAt = 0
+            return False
+
+        with self.cond:
+            if error is None:
+                for key, notification in batch:
+                    self.discard(key, notification)
+                if self.failures:
+                    logger.info('Server is reachable again, flushing {} pending notifications'.format(self.queued))
+                    self.failures = 0
+                    self.retryAt = 0
+                    if self.outbox is not None:
+                        self.outbox.compact()
+                return True
+
+            self.failures += 1
+            self.retryAt = time.time() + self.retryPolicy.getDelay(self.failures)
+            for key, notification in batch:
+                if notification[3] is not None and not isinstance(error, InvalidResponseError):
+                    continue  # Durable notifications are kept while server is unreachable
+                notification[2] += 1
+                if notification[2] > self.maxRetries:
+                    logger.error('Discarding notification {} after {} retries'.format(notification[0],
+                                                                                      self.maxRetries))
+                    self.dropped += 1
+                    self.discard(key, notification)
+            return False
+
+    def run(self):
+        while True:
+            with self.cond:
+                batch = self.nextBatch()
+            if batch is None:
+                break
+            self.sendBatch(batch)
+
+        with self.cond:
+            if self.queued:
+                logger.error('Notification sender stopped with {} notifications not sent'.format(self.queued))
@@ -33,18 +33,47 @@
 
 from __future__ import unicode_literals
 import sys
+import types
+
+from . import utils
 
 # Importing platform operations and getting operating system data.
 if sys.platform == 'win32':
     from .windows.operations import *  # @UnusedWildImport
     os_type = 'Windows'
-    os_version = getWindowsVersion()
+    _getOsVersion = getWindowsVersion
 else:
     if sys.platform == 'darwin':
         from .macos.operations import *  # @UnusedWildImport
         os_type = 'MacOS'
-        os_version = getMacosVersion().replace(',', '')
+
+        def _getOsVersion():
+            return getMacosVersion().replace(',', '')
     else:
         from .linux.operations import *  # @UnusedWildImport
         os_type = 'Linux'
-        os_version = getLinuxVersion()
+        _getOsVersion = getLinuxVersion
+
+@utils.memoized
+def getOsVersion():
+    '''
+    Returns operating system version, obtained on first use
+    '''
+    return _getOsVersion()
+
+
+class _OperationsModule(types.ModuleType):
+    '''
+    This module, providing os_version attribute (kept for external modules, getOsVersion should be used instead),
+    obtained on first use
+    '''
+    def __getattr__(self, name):
+        if name == 'os_version':
+            return getOsVersion()
+        raise AttributeError("'module' object has no attribute '{}'".format(name))
+
+
+_module = _OperationsModule(__name__, __doc__)
+_module.__dict__.update(globals())
+_module._original = sys.modules[__name__]  # Keep original module alive, as its functions use its globals
+sys.modules[__name__] = _module
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Durable storage for notifications not yet delivered to remote REST servers
+"""
+from __future__ import unicode_literals
+
+import os
+import json
+import tempfile
+import threading
+import collections
+
+from . import operations
+from .log import logger
+from .utils import exceptionToMessage
+
+MAX_ENTRIES = 1000  # Maximum number of notifications kept on outbox
+O_NOFOLLOW = getattr(os, 'O_NOFOLLOW', 0)  # Not available on Windows
+
+
+class Outbox(object):
+    """
+    Append only journal of notifications pending to be delivered, so they survive agent restarts (or crashes).
+    Every line of the journal is a json record, either a notification:
+        {"id": 1, "key": "session", "message": "ogagent/loggedin", "data": {...}}
+    or the acknowledge of a delivered (or discarded) one:
+        {"ack": 1}
+    Every record is flushed to disk when written. A broken last line (crash while writing) is ignored on load.
+    Journal is rewritten with just pending notifications on load and when acknowledged records pile up.
+    As notifications are replayed to server, journal is only created by (and trusted if owned by) current user
+    (service account or administrators on Windows), and only accessible by it. It should be kept on a directory only
+    writable by its user, too (see utils.makePrivateDir).
+    """
+    def __init__(self, path, maxEntries=MAX_ENTRIES):
+        self.path = path
+        self.maxEntries = maxEntries
+        self.lock = threading.RLock()
+        self.pending = collections.OrderedDict()
+        self.lastId = 0
+        self.acked = 0
+        self.journal = None
+        self.load()
+
+    def load(self):
+        with self.lock:
+            try:
+                with os.fdopen(os.open(self.path, os.O_RDONLY | O_NOFOLLOW), 'r') as f:
+                    if os.name == 'posix':
+                        st = os.fstat(f.fileno())
+                        if st.st_uid != os.geteuid() or st.st_mode & 0o077:
+                            raise ValueError('Outbox {} is not safe, ignoring it'.format(self.path))
+                    elif os.name == 'nt' and not operations.is_trusted_path(self.path):
+                        raise ValueError('Outbox {} is not safe, ignoring it'.format(self.path))
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            logger.warn('Ignoring broken record on outbox {}'.format(self.path))
+                            continue
+                        if 'ack' in record:
+                            self.pending.pop(record['ack'], None)
+                        else:
+                            self.pending[record['id']] = record
+                            self.lastId = max(self.lastId, record['id'])
+            except (IOError, OSError):
+                pass  # No outbox yet
+            except ValueError as e:
+                logger.error(exceptionToMessage(e))
+            if self.pending:
+                logger.info('Loaded {} pending notifications from outbox {}'.format(len(self.pending), self.path))
+            self.compact()
+
+    def write(self, record):
+        if self.journal is None:
+            self.journal = os.fdopen(os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | O_NOFOLLOW, 0o600),
+                                     'a')
+        self.journal.write(json.dumps(record) + '\n')
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def compact(self):
+        """
+        Rewrites journal with only pending notifications
+        """
+        with self.lock:
+            tmpPath = None
+            try:
+                if self.journal is not None:
+                    self.journal.close()
+                    self.journal = None
+                fd, tmpPath = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.',
+                                               dir=os.path.dirname(os.path.abspath(self.path)))  # Only owner access
+                with os.fdopen(fd, 'w') as f:
+                    for record in self.pending.values():
+                        f.write(json.dumps(record) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                if os.name == 'nt' and os.path.exists(self.path):
+                    os.remove(self.path)  # Rename does not replace files on Windows
+                os.rename(tmpPath, self.path)
+                self.acked = 0
+            except Exception as e:
+                logger.error('Could not compact outbox {}: {}'.format(self.path, exceptionToMessage(e)))
+                if tmpPath is not None and os.path.exists(tmpPath):
+                    os.remove(tmpPath)
+
+    def append(self, key, message, data):
+        """
+        Stores a notification, discarding the oldest one if outbox is full
+        @return: id of stored notification, and id of discarded one (or None)
+        """
+        with self.lock:
+            discarded = None
+            if len(self.pending) >= self.maxEntries:
+                discarded = next(iter(self.pending))
+                logger.error('Outbox is full, discarding notification {}'.format(self.pending[discarded]['message']))
+                self.ack(discarded)
+            self.lastId += 1
+            record = {'id': self.lastId, 'key': key, 'message': message, 'data': data}
+            self.pending[self.lastId] = record
+            try:
+                self.write(record)
+            except Exception as e:
+                logger.error('Could not write to outbox {}: {}'.format(self.path, exceptionToMessage(e)))
+            return self.lastId, discarded
+
+    def ack(self, notificationId):
+        """
+        Marks a notification as delivered (or discarded), so it will not be loaded again
+        """
+        with self.lock:
+            if self.pending.pop(notificationId, None) is None:
+                return
+            try:
+                self.write({'ack': notificationId})
+            except Exception as e:
+                logger.error('Could not write to outbox {}: {}'.format(self.path, exceptionToMessage(e)))
+            self.acked += 1
+            if self.acked > self.maxEntries:
+                self.compact()
+
+    def items(self):
+        """
+        Returns pending notifications, in order
+        """
+        with self.lock:
+            return list(self.pending.values())
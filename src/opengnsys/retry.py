@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Retry policies for operations against remote servers
+"""
+from __future__ import unicode_literals
+
+import random
+import sys
+import time
+import six
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with full jitter: before retry number n, waits a random time between 0 and
+    min(cap, base * 2 ** (n - 1)) seconds, so many agents retrying at once (i.e. a whole lab powering on)
+    spread their requests instead of hitting the server in lockstep.
+    Retries end when maxAttempts is reached or when waiting would go past deadline (seconds since first attempt)
+    Examples:
+       policy = RetryPolicy(base=1, cap=30, deadline=300)
+       for attempt in policy.attempts():
+           try:
+               doSomething()
+               break
+           except Exception:
+               pass
+       or just:
+       policy.run(doSomething)
+    """
+    def __init__(self, base=1, cap=60, deadline=None, maxAttempts=None):
+        self.base = base
+        self.cap = cap
+        self.deadline = deadline
+        self.maxAttempts = maxAttempts
+
+    def getDelay(self, retry):
+        """
+        Returns the time to wait before retry number "retry" (first retry is 1)
+        """
+        return random.uniform(0, min(self.cap, self.base * 2 ** min(retry - 1, 32)))
+
+    def attempts(self):
+        """
+        Generator of attempt numbers (starting at 0), waiting as needed between them
+        """
+        start = time.time()
+        attempt = 0
+        while True:
+            yield attempt
+            attempt += 1
+            if self.maxAttempts is not None and attempt >= self.maxAttempts:
+                return
+            delay = self.getDelay(attempt)
+            if self.deadline is not None:
+                remaining = start + self.deadline - time.time()
+                if remaining <= 0:
+                    return
+                delay = min(delay, remaining)
+            time.sleep(delay)
+
+    def run(self, fnc, *args, **kwargs):
+        """
+        Invokes fnc until it does not raise an exception, and returns its result
+        If no more retries are allowed, last exception is raised
+        """
+        error = None
+        for _ in self.attempts():
+            try:
+                return fnc(*args, **kwargs)
+            except Exception:
+                error = sys.exc_info()
+        six.reraise(*error)
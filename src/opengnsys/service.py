@@ -31,46 +31,103 @@
 '''
 from __future__ import unicode_literals
 
-from .log import logger
+from .log import logger, DEBUG, LOG_MAXSIZE, LOG_BACKUPS
 from .config import readConfig
 from .utils import exceptionToMessage
 
 from . import ipc
 from . import httpserver
+from . import operations
+from . import STARTED_AT
 from .loader import loadModules
+from .netwatcher import NetworkWatcher
+from .hostinfo import hostInfo
+from .dispatcher import EventDispatcher
 
 import socket
+import threading
 import time
 import json
 import six
 
 IPC_PORT = 10398
+ACTIVATION_CHECK = 1  # Seconds between checks for activation timeouts and stop requests
+
+
+class ModuleActivation(threading.Thread):
+    '''
+    Activates a module on its own thread, putting itself on "done" queue when finished (unless it timed out)
+    '''
+    def __init__(self, module, done):
+        super(ModuleActivation, self).__init__(name='Activation-{}'.format(module.name))
+        self.daemon = True
+        self.module = module
+        self.done = done
+        self.error = None
+        self.elapsed = None
+        self.timedOut = False
+        self.lock = threading.Lock()
+        self.started = time.time()
+        timeout = module.activationTimeout
+        self.deadline = self.started + timeout if timeout is not None else None
+
+    def run(self):
+        try:
+            operations.initThread()
+            self.module.activate()
+        except Exception as e:
+            logger.exception()
+            self.error = e
+        with self.lock:
+            self.elapsed = time.time() - self.started
+            timedOut = self.timedOut
+        if not timedOut:
+            self.done.put(self)
+        elif self.error is None:
+            # Service has already given up on this module, so it must not stay (partially) working
+            logger.warn('Module %s activated %.0f s after starting, too late, deactivating it',
+                        self.module.name, self.elapsed)
+            try:
+                self.module.deactivate()
+            except Exception as e:
+                logger.error('Deactivation of %s failed: %s', self.module.name, exceptionToMessage(e))
 
 
 class CommonService(object):
     isAlive = True
     ipc = None
     httpServer = None
+    networkWatcher = None
+    dispatcher = None
     modules = None
+    activationTimes = None
     
     def __init__(self):
+        self.startupTimes = []
+        self.startupMark = STARTED_AT
+        self.startupStep('imports')
+
         logger.info('----------------------------------------')
         logger.info('Initializing OpenGnsys Agent')
         
         # Read configuration file before proceding & ensures minimal config is there
 
         self.config = readConfig()
+        self.startupStep('configuration')
 
         # Get opengnsys section as dict        
         cfg = dict(self.config.items('opengnsys'))
     
         # Set up log level
         logger.setLevel(cfg.get('log', 'INFO'))
+        logger.setRotation(cfg.get('log_maxsize', LOG_MAXSIZE), cfg.get('log_maxage'),
+                           cfg.get('log_backups', LOG_BACKUPS))
 
         
-        logger.debug('Loaded configuration from opengnsys.cfg:')
-        for section in self.config.sections():
-            logger.debug('Section {} = {}'.format(section, self.config.items(section)))
+        if logger.isEnabledFor(DEBUG):
+            logger.debug('Loaded configuration from opengnsys.cfg:')
+            for section in self.config.sections():
+                logger.debug('Section %s = %s', section, self.config.items(section))
             
     
         if logger.logger.isWindows():
@@ -79,15 +136,114 @@ class CommonService(object):
             
         self.address = (cfg.get('address', '0.0.0.0'), int(cfg.get('port', '10997')))
         self.ipcport = int(cfg.get('ipc_port', IPC_PORT))
+        self.httpWorkers = int(cfg.get('workers', '0'))
         
         self.timeout = int(cfg.get('timeout', '20'))
         
-        logger.debug('Socket timeout: {}'.format(self.timeout))
+        logger.debug('Socket timeout: %s', self.timeout)
         socket.setdefaulttimeout(self.timeout)
         
         # Now load modules
         self.modules = loadModules(self)
-        logger.debug('Modules: {}'.format(list(v.name for v in self.modules)))
+        self.startupStep('modules loading')
+        logger.debug('Modules: %s', list(v.name for v in self.modules))
+
+    def activateModules(self):
+        '''
+        Activates modules, each one on its own thread once the modules it depends on are active.
+        Modules failing, depending on failed (or not loaded) modules or exceeding their activationTimeout (that can be
+        set on "activation_timeout" option of module section of configuration) are dropped
+        If service is requested to stop meanwhile, modules still being activated are dropped too
+        Returns modules successfully activated (in loading order), keeping activation times on activationTimes
+        '''
+        for mod in self.modules:
+            if self.config.has_option(mod.name, 'activation_timeout'):
+                mod.activationTimeout = self.config.getint(mod.name, 'activation_timeout') or None
+        self.activationTimes = {}
+        names = set(mod.name for mod in self.modules)
+        pending = list(self.modules)
+        running = []
+        active = set()
+        failed = set()
+        done = six.moves.queue.Queue()  # @UndefinedVariable
+
+        def fail(name, reason, *args):
+            failed.add(name)
+            logger.error('Activation of %s failed: ' + reason, name, *args)
+
+        while (pending or running) and self.isAlive:
+            changed = True
+            while changed:
+                changed = False
+                for mod in list(pending):
+                    dependencies = set(mod.dependencies)
+                    unavailable = (dependencies - names) | (dependencies & failed)
+                    if unavailable:
+                        fail(mod.name, 'modules %s not active', ', '.join(sorted(unavailable)))
+                    elif dependencies <= active:
+                        logger.debug('Activating module %s', mod.name)
+                        activation = ModuleActivation(mod, done)
+                        activation.start()
+                        running.append(activation)
+                    else:
+                        continue
+                    pending.remove(mod)
+                    changed = True
+
+            if not running:
+                # Remaining modules depend on each other
+                for mod in pending:
+                    fail(mod.name, 'circular dependencies')
+                break
+
+            deadlines = [a.deadline for a in running if a.deadline is not None]
+            timeout = min([ACTIVATION_CHECK] + [deadline - time.time() for deadline in deadlines])
+            try:
+                activation = done.get(timeout=max(timeout, 0.01))
+                running.remove(activation)
+                if activation.error is None:
+                    self.activationTimes[activation.module.name] = activation.elapsed
+                    logger.info('Module %s activated in %.0f ms', activation.module.name, activation.elapsed * 1000)
+                    active.add(activation.module.name)
+                else:
+                    fail(activation.module.name, '%s', exceptionToMessage(activation.error))
+            except six.moves.queue.Empty:  # @UndefinedVariable
+                pass
+
+            now = time.time()
+            for activation in list(running):
+                if activation.deadline is None or now < activation.deadline:
+                    continue
+                with activation.lock:
+                    if activation.elapsed is not None:
+                        continue  # Just finished, it's on the queue
+                    activation.timedOut = True
+                running.remove(activation)
+                fail(activation.module.name, 'not finished after %s seconds', activation.module.activationTimeout)
+
+        if not self.isAlive:
+            for activation in running:
+                with activation.lock:
+                    activation.timedOut = activation.elapsed is None  # If it ends later, it will deactivate itself
+                if activation.timedOut:
+                    fail(activation.module.name, 'service is stopping')
+                elif activation.error is None:  # Finished, but not yet taken from queue
+                    self.activationTimes[activation.module.name] = activation.elapsed
+                    active.add(activation.module.name)
+                else:
+                    fail(activation.module.name, '%s', exceptionToMessage(activation.error))
+            for mod in pending:
+                fail(mod.name, 'service is stopping')
+
+        return [mod for mod in self.modules if mod.name in active]
+
+    def startupStep(self, name):
+        '''
+        Records time spent on a startup step (since previous one)
+        '''
+        now = time.time()
+        self.startupTimes.append((name, now - self.startupMark))
+        self.startupMark = now
         
     def stop(self):
         '''
@@ -98,42 +254,47 @@ class CommonService(object):
     # ********************************
     # * Internal messages processors *
     # ********************************
+    # Modules are notified through dispatcher, each one on its own thread, so a slow module does not delay others
     def notifyLogin(self, username):
         for v in self.modules:
-            try:
-                logger.debug('Notifying login of user {} to module {}'.format(username, v.name))
-                v.onLogin(username)
-            except Exception as e:
-                logger.error('Got exception {} processing login message on {}'.format(e, v.name))
+            logger.debug('Notifying login of user %s to module %s', username, v.name)
+            self.dispatcher.dispatch(v, 'login', v.onLogin, username)
     
     def notifyLogout(self, username):
         for v in self.modules:
-            try:
-                logger.debug('Notifying logout of user {} to module {}'.format(username, v.name))
-                v.onLogout(username)
-            except Exception as e:
-                logger.error('Got exception {} processing logout message on {}'.format(e, v.name))
+            logger.debug('Notifying logout of user %s to module %s', username, v.name)
+            self.dispatcher.dispatch(v, 'logout', v.onLogout, username)
                 
     def notifyMessage(self, data):
         module, message, data = data.split('\0')
         for v in self.modules:
             if v.name == module:  # Case Sensitive!!!!
                 try:
-                    logger.debug('Notifying message {} to module {} with json data {}'.format(message, v.name, data))
-                    v.processClientMessage(message, json.loads(data))
+                    logger.debug('Notifying message %s to module %s with json data %s', message, v.name, data)
+                    self.dispatcher.dispatch(v, message, v.processClientMessage, message, json.loads(data))
                     return
                 except Exception as e:
-                    logger.error('Got exception {} processing generic message on {}'.format(e, v.name))
+                    logger.error('Got exception %s processing generic message on %s', e, v.name)
+                    return
+
+        logger.error('Module %s not found, messsage %s not sent', module, message)
 
-        logger.error('Module {} not found, messsage {} not sent'.format(module, message))
+    def notifyNetworkChange(self, interfaces):
+        '''
+        Callback, invoked from network watcher thread
+        '''
+        hostInfo.set('network', interfaces)
+        for v in self.modules:
+            logger.debug('Notifying network change to module %s', v.name)
+            self.dispatcher.dispatch(v, 'network change', v.onNetworkChange, interfaces)
                      
 
     def clientMessageProcessor(self, msg, data):
         '''
         Callback, invoked from IPC, on its own thread (not the main thread).
-        This thread will "block" communication with agent untill finished, but this should be no problem
+        Modules are notified on their own threads, so communication with agent is not blocked by them
         '''
-        logger.debug('Got message {}'.format(msg))
+        logger.debug('Got message %s', msg)
         
         if msg == ipc.REQ_LOGIN:
             self.notifyLogin(data)
@@ -148,41 +309,51 @@ class CommonService(object):
         # ******************************************
         
         if six.PY3 is False:
-            import threading
             threading._DummyThread._Thread__stop = lambda x: 42
         
-        logger.debug('Starting IPC listener at {}'.format(IPC_PORT))
+        # Http threaded server is created first, so pre-forked workers (if any) are forked before any other thread
+        self.httpServer = httpserver.HTTPServerThread(self.address, self, self.httpWorkers)
+        self.startupStep('http server')
+
+        self.dispatcher = EventDispatcher()
+
+        logger.debug('Starting IPC listener at %s', IPC_PORT)
         self.ipc = ipc.ServerIPC(self.ipcport, clientMessageProcessor=self.clientMessageProcessor)
         self.ipc.start()
+        self.startupStep('ipc')
 
-        # And http threaded server
-        self.httpServer = httpserver.HTTPServerThread(self.address, self)
         self.httpServer.start()
-        
+
+        # Modules are notified about network changes from now on (activation can wait for network to be ready)
+        self.networkWatcher = NetworkWatcher(self.notifyNetworkChange)
+        self.networkWatcher.start()
+        self.startupStep('network watcher')
+
         # And lastly invoke modules activation
-        validMods = []
-        for mod in self.modules:
-            try:
-                logger.debug('Activating module {}'.format(mod.name))
-                mod.activate()
-                validMods.append(mod)
-            except Exception as e:
-                logger.exception()
-                logger.error("Activation of {} failed: {}".format(mod.name, exceptionToMessage(e)))
-        
-        self.modules[:] = validMods  # copy instead of assignment
+        self.modules[:] = self.activateModules()  # copy instead of assignment
         
-        logger.debug('Modules after activation: {}'.format(list(v.name for v in self.modules)))
+        logger.debug('Modules after activation: %s', list(v.name for v in self.modules))
+
+        self.startupStep('modules activation')
+        logger.info('Agent started in %.0f ms (%s)', sum(t for _, t in self.startupTimes) * 1000,
+                    ', '.join('{} {:.0f} ms'.format(name, t * 1000) for name, t in self.startupTimes))
 
     def terminate(self):
+        if self.networkWatcher is not None:
+            self.networkWatcher.stop()
+
+        # Pending events are processed before deactivation
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+
         # First invoke deactivate on modules
         for mod in reversed(self.modules):
             try:
-                logger.debug('Deactivating module {}'.format(mod.name))
+                logger.debug('Deactivating module %s', mod.name)
                 mod.deactivate()
             except Exception as e:
                 logger.exception()
-                logger.error("Deactivation of {} failed: {}".format(mod.name, exceptionToMessage(e)))
+                logger.error("Deactivation of %s failed: %s", mod.name, exceptionToMessage(e))
         
         # Remove IPC threads
         if self.ipc is not None:
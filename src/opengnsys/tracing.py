@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2014 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Timing capture of outbound HTTP requests (name resolution, connect, TLS handshake, first byte and total times)
+"""
+from __future__ import unicode_literals
+
+import collections
+import socket
+import threading
+import time
+
+from .log import logger
+
+TRACE_SIZE = 100  # Traced requests kept
+
+try:
+    from requests.adapters import HTTPAdapter
+    from requests.packages.urllib3 import connection, connectionpool
+    from requests.packages.urllib3.util import connection as utilConnection
+except Exception:
+    HTTPAdapter = None  # Very old requests lib, just total times will be traced
+
+_current = threading.local()  # Trace of request being sent by every thread
+
+
+class Trace(object):
+    """
+    Times of a request, in seconds. Phases not performed (i.e. connection was reused) are None
+    """
+    def __init__(self, method, url):
+        self.method = method
+        self.url = url
+        self.started = time.time()
+        self.resolve = None
+        self.connect = None
+        self.tls = None
+        self.firstByte = None
+        self.total = None
+        self.status = None
+        self.error = None
+
+    def mark(self, phase, since):
+        elapsed = time.time() - since
+        setattr(self, phase, elapsed)
+        return elapsed
+
+    def asDict(self):
+        return {'method': self.method, 'url': self.url, 'started': self.started, 'resolve': self.resolve,
+                'connect': self.connect, 'tls': self.tls, 'firstByte': self.firstByte, 'total': self.total, 'status': self.status,
+                'error': self.error}
+
+    def __str__(self):
+        def fmt(value):
+            return '-' if value is None else '{:.3f}'.format(value)
+
+        return '{} {} {}: resolve {}, connect {}, tls {}, first byte {}, total {}{}'.format(
+            self.method, self.url, self.status, fmt(self.resolve), fmt(self.connect), fmt(self.tls),
+            fmt(self.firstByte), fmt(self.total), ' ({})'.format(self.error) if self.error else '')
+
+
+def currentTrace():
+    return getattr(_current, 'trace', None)
+
+
+class Tracer(object):
+    """
+    Keeps the last traced requests (on a ring buffer), logging them at debug level
+    Example:
+        trace = tracer.begin('GET', url)
+        try:
+            ... send request using a TracingAdapter, so phases are timed ...
+        finally:
+            tracer.end(trace, status, error)
+    """
+    def __init__(self, size=TRACE_SIZE):
+        self.traces = collections.deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def begin(self, method, url):
+        _current.trace = Trace(method, url)
+        return _current.trace
+
+    def end(self, trace, status=None, error=None):
+        trace.mark('total', trace.started)
+        trace.status = status
+        trace.error = error
+        _current.trace = None
+        with self.lock:
+            self.traces.append(trace)
+        logger.debug('Request {}'.format(trace))
+
+    def getTraces(self):
+        with self.lock:
+            return [t.asDict() for t in self.traces]
+
+    def summary(self):
+        """
+        Returns number of requests and errors, and average and maximum times of every phase
+        """
+        with self.lock:
+            traces = list(self.traces)
+        res = {'requests': len(traces), 'errors': len([t for t in traces if t.error])}
+        for phase in ('resolve', 'connect', 'tls', 'firstByte', 'total'):
+            values = [getattr(t, phase) for t in traces if getattr(t, phase) is not None]
+            res[phase] = {'count': len(values), 'avg': sum(values) / len(values) if values else None,
+                          'max': max(values) if values else None}
+        return res
+
+
+if HTTPAdapter is not None:
+    _createConnection = utilConnection.create_connection
+
+    def createConnection(address, *args, **kwargs):
+        """
+        Replaces urllib3 create_connection, so name resolution of traced requests is timed on its own: host is
+        resolved here, and resolved addresses are tried in order (so name is not resolved again)
+        """
+        trace = currentTrace()
+        if trace is None:
+            return _createConnection(address, *args, **kwargs)
+        host, port = address
+        start = time.time()
+        family = getattr(utilConnection, 'allowed_gai_family', lambda: socket.AF_UNSPEC)()
+        try:
+            infos = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+        finally:
+            trace.mark('resolve', start)
+        error = socket.error('getaddrinfo returns an empty list')
+        for info in infos:
+            try:
+                return _createConnection(info[4][:2], *args, **kwargs)
+            except socket.error as e:
+                error = e
+        raise error
+
+    utilConnection.create_connection = createConnection
+
+    class TracedConnectionMixin(object):
+        """
+        Times connection and first byte of urllib3 connections used by a traced request
+        """
+        def _new_conn(self):
+            trace = currentTrace()
+            start = time.time()
+            conn = super(TracedConnectionMixin, self)._new_conn()
+            if trace is not None:
+                trace.connect = time.time() - start - (trace.resolve or 0)
+            return conn
+
+        def getresponse(self, *args, **kwargs):
+            response = super(TracedConnectionMixin, self).getresponse(*args, **kwargs)
+            trace = currentTrace()
+            if trace is not None:
+                trace.mark('firstByte', trace.started)
+            return response
+
+    class TracedHTTPConnection(TracedConnectionMixin, connection.HTTPConnection):
+        pass
+
+    class TracedHTTPSConnection(TracedConnectionMixin, connection.HTTPSConnection):
+        def connect(self):
+            trace = currentTrace()
+            start = time.time()
+            super(TracedHTTPSConnection, self).connect()
+            if trace is not None and trace.connect is not None:
+                trace.tls = time.time() - start - (trace.resolve or 0) - trace.connect
+
+    class TracedHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+        ConnectionCls = TracedHTTPConnection
+
+    class TracedHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+        ConnectionCls = TracedHTTPSConnection
+
+    class TracingAdapter(HTTPAdapter):
+        """
+        requests adapter using traced connections
+        """
+        def init_poolmanager(self, *args, **kwargs):
+            super(TracingAdapter, self).init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {'http': TracedHTTPConnectionPool,
+                                                       'https': TracedHTTPSConnectionPool}
+else:
+    TracingAdapter = None
@@ -31,6 +31,8 @@
 '''
 from __future__ import unicode_literals
 
+import os
+import stat
 import sys
 import six
 
@@ -70,3 +72,38 @@ class Bunch(dict):
         dict.__init__(self, kw)
         self.__dict__ = self
 
+
+
+def memoized(fnc):
+    '''
+    Decorator for functions without arguments whose result does not change while running (i.e. platform probes),
+    so they are evaluated on first use, only once
+    '''
+    result = []
+
+    def wrapper():
+        if not result:
+            result.append(fnc())
+        return result[0]
+
+    wrapper.__name__ = fnc.__name__
+    wrapper.__doc__ = fnc.__doc__
+    return wrapper
+
+
+def makePrivateDir(path):
+    '''
+    Creates a directory only accessible by current user (if it does not exist yet)
+    Raises an exception if it's not safe: not owned by current user, or writable by others
+    On Windows, where mode is ignored, its access is restricted to service account and administrators
+    '''
+    if not os.path.isdir(path):
+        os.makedirs(path, 0o700)
+    if os.name == 'posix':
+        st = os.lstat(path)  # Not following symbolic links
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid() or st.st_mode & 0o022:
+            raise OSError('Directory {} is not safe (owned by other user or writable by others)'.format(path))
+    elif os.name == 'nt':
+        from . import operations  # Not imported on module load, as operations depends on utils
+        operations.make_private_path(path)
+    return path
@@ -99,6 +99,7 @@ class OGAgentSvc(win32serviceutil.ServiceFramework, CommonService):
         except Exception:  # Any init exception wil be caught, service must be then restarted
             logger.exception()
             logger.debug('Exiting service with failure status')
+            logger.flush()
             os._exit(-1)  # pylint: disable=protected-access
 
         # *********************
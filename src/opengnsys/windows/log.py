@@ -32,10 +32,11 @@
 from __future__ import unicode_literals
 
 import servicemanager  # @UnresolvedImport, pylint: disable=import-error
-import logging
 import os
 import tempfile
 
+from opengnsys.loghandler import createFileLogger, logRecord
+
 # Valid logging levels, from UDS Broker (uds.core.utils.log)
 OTHER, DEBUG, INFO, WARN, ERROR, FATAL = (10000 * (x + 1) for x in range(6))
 
@@ -44,21 +45,15 @@ class LocalLogger(object):
     def __init__(self):
         # tempdir is different for "user application" and "service"
         # service wil get c:\windows\temp, while user will get c:\users\XXX\temp
-        logging.basicConfig(
-            filename=os.path.join(tempfile.gettempdir(), 'opengnsys.log'),
-            filemode='a',
-            format='%(levelname)s %(asctime)s %(message)s',
-            level=logging.DEBUG
-        )
-        self.logger = logging.getLogger('opengnsys')
+        self.logger, self.handler = createFileLogger(os.path.join(tempfile.gettempdir(), 'opengnsys.log'))
         self.serviceLogger = False
 
-    def log(self, level, message):
+    def log(self, level, message, created=None, threadName=None):
         # Debug messages are logged to a file
         # our loglevels are 10000 (other), 20000 (debug), ....
         # logging levels are 10 (debug), 20 (info)
         # OTHER = logging.NOTSET
-        self.logger.log(level / 1000 - 10, message)
+        logRecord(self.logger, level / 1000 - 10, message, created, threadName)
 
         if level < INFO or self.serviceLogger is False:  # Only information and above will be on event log
             return
@@ -70,6 +65,20 @@ class LocalLogger(object):
         else:  # Error & Fatal
             servicemanager.LogErrorMsg(message)
 
+    def setRotation(self, maxBytes, maxAge, backupCount):
+        self.handler.setRotation(maxBytes, maxAge, backupCount)
+
+    def afterFork(self, rotate=False):
+        self.handler.createLock()
+        if rotate:
+            self.handler.claimRotation()
+
+    def batch(self):
+        '''
+        Context manager for logging several messages, writing them to disk at once
+        '''
+        return self.handler.batch()
+
     def isWindows(self):
         return True
 
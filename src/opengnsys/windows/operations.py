@@ -39,6 +39,7 @@ from ctypes.wintypes import DWORD, LPCWSTR
 import win32com.client  # @UnresolvedImport, pylint: disable=import-error
 import win32net  # @UnresolvedImport, pylint: disable=import-error
 import win32security  # @UnresolvedImport, pylint: disable=import-error
+import ntsecuritycon  # @UnresolvedImport, pylint: disable=import-error
 import win32api  # @UnresolvedImport, pylint: disable=import-error
 import win32con  # @UnresolvedImport, pylint: disable=import-error
 
@@ -240,6 +241,13 @@ def getIdleDuration():
     return millis / 1000.0
 
 
+def closeIdleDuration():
+    '''
+    Nothing is kept open to get idle duration
+    '''
+    pass
+
+
 def getCurrentUser():
     '''
     Returns current logged in username
@@ -275,3 +283,52 @@ def get_etc_path():
     Returns etc directory path.
     """
     return os.path.join('C:', os.sep, 'Windows', 'System32', 'drivers', 'etc')
+
+
+def get_state_path():
+    """
+    :return:
+    Returns directory path for agent state kept across restarts (only accessible by agent).
+    """
+    return os.path.join(os.environ.get('ProgramData', os.path.join('C:', os.sep, 'ProgramData')), 'OGAgent')
+
+
+def _trusted_sids():
+    # LocalSystem (service account) and Administrators
+    return [win32security.ConvertStringSidToSid(sid) for sid in ('S-1-5-18', 'S-1-5-32-544')]
+
+
+def is_trusted_path(path):
+    '''
+    Returns True if path is owned by service account (or administrators), so other users have not created it
+    '''
+    sd = win32security.GetNamedSecurityInfo(path, win32security.SE_FILE_OBJECT,
+                                            win32security.OWNER_SECURITY_INFORMATION)
+    return sd.GetSecurityDescriptorOwner() in _trusted_sids()
+
+
+def make_private_path(path):
+    '''
+    Restricts access to a directory (and files created on it) to service account and administrators, as users can
+    create files on ProgramData by default
+    Raises an exception if it's owned by other user (it could have been created, and filled, by that user)
+    '''
+    if not is_trusted_path(path):
+        raise OSError('Directory {} is not safe (owned by other user)'.format(path))
+    dacl = win32security.ACL()
+    for sid in _trusted_sids():
+        dacl.AddAccessAllowedAceEx(win32security.ACL_REVISION,
+                                   win32security.OBJECT_INHERIT_ACE | win32security.CONTAINER_INHERIT_ACE,
+                                   ntsecuritycon.FILE_ALL_ACCESS, sid)
+    # Protected, so permissions inherited from parent directory are removed
+    win32security.SetNamedSecurityInfo(path, win32security.SE_FILE_OBJECT,
+                                       win32security.DACL_SECURITY_INFORMATION |
+                                       win32security.PROTECTED_DACL_SECURITY_INFORMATION, None, None, dacl, None)
+
+
+def initThread():
+    '''
+    Prepares a thread (other than main one) for using operations: COM is used to get network info
+    '''
+    import pythoncom  # @UnresolvedImport, pylint: disable=import-error
+    pythoncom.CoInitialize()
@@ -46,6 +46,7 @@ class ClientWorker(object):
     '''
     name = None
     service = None
+    idleThresholds = ()  # Idle times (in seconds) that invoke onIdle when reached
     
     def __init__(self, service):
         self.service = service
@@ -100,6 +101,22 @@ class ClientWorker(object):
         '''
         pass
 
+    def onIdle(self, threshold, idle):
+        '''
+        Invoked when user has been idle for at least threshold seconds (one of idleThresholds)
+        This CAN be overridden by modules
+        This method is invoked inside idle monitor thread, so other modules are not notified until it returns
+        '''
+        pass
+
+    def onActive(self, threshold, idle):
+        '''
+        Invoked when user is active again after having been idle for threshold seconds (one of idleThresholds)
+        This CAN be overridden by modules
+        This method is invoked inside idle monitor thread, so other modules are not notified until it returns
+        '''
+        pass
+
     # *************************************
     # * Helper, convenient helper methods *
     # *************************************
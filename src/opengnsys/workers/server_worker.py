@@ -34,8 +34,13 @@ from __future__ import unicode_literals
 class ServerWorker(object):
     '''
     A ServerWorker is a server module that "works" for service
-    Most method are invoked inside their own thread, except onActivation & onDeactivation. 
-    This two methods are invoked inside main service thread, take that into account when creating them
+    Most method are invoked inside their own thread, except onDeactivation, that is invoked inside main service thread.
+    onActivation is invoked on its own thread too, in parallel with activation of modules not depending on it
+    (modules it depends on, listed on dependencies, are already active at that point).
+    If it takes longer than activationTimeout seconds, module is considered failed (and deactivated when it ends).
+    Note that activationTimeout is 60 seconds by default (activation used to have no limit): modules that can take
+    longer must set their own one, or None for no limit. It can also be set on "activation_timeout" option of module
+    section of configuration (0 for no limit).
     
     * You must provide a module name (override name on your class), so we can identify the module by a "valid" name.
       A valid name is like a valid python variable (do not use spaces, etc...)
@@ -47,6 +52,11 @@ class ServerWorker(object):
     name = None
     service = None
     locked = False
+    dependencies = ()  # Names of modules that must be activated before this one
+    activationTimeout = 60  # Seconds activation can take before module is considered failed (None for no limit)
+    maxConcurrent = None  # Requests processed at once by module (None for no limit)
+    maxQueued = 0  # Requests waiting while maxConcurrent ones are being processed, more are rejected (503 error)
+    routeLimits = {}  # Routes (first path element) with their own limits, as {route: (maxConcurrent, maxQueued)}
     
     def __init__(self, service):
         self.service = service
@@ -131,8 +141,8 @@ class ServerWorker(object):
         '''
         Invoked by Service for activation.
         This MUST be overridden by modules!
-        This method is invoked inside main thread, so if it "hangs", complete service will hang
-        This should be no problem, but be advised about this
+        This method is invoked inside its own thread, and service startup waits for it at most activationTimeout seconds
+        Raise an exception if module can't be activated
         '''
         pass
     
@@ -151,7 +161,7 @@ class ServerWorker(object):
         Invoked by Service when an user login is detected
         This CAN be overridden by modules
         This method is invoked whenever the client (user space agent) notifies the server (Service) that a user has logged in.
-        This method is run on its own thread
+        This method is run on module events thread, after previous events notified to module
         '''
         pass
     
@@ -160,7 +170,16 @@ class ServerWorker(object):
         Invoked by Service when an user login is detected
         This CAN be overridden by modules
         This method is invoked whenever the client (user space agent) notifies the server (Service) that a user has logged in.
-        This method is run on its own thread
+        This method is run on module events thread, after previous events notified to module
+        '''
+        pass
+
+    def onNetworkChange(self, interfaces):
+        '''
+        Invoked by Service when network interfaces or their addresses change (also while modules are being activated)
+        This CAN be overridden by modules
+        interfaces is the new result of operations.getNetworkInfo (as a list)
+        This method is run on module events thread, after previous events notified to module
         '''
         pass
     
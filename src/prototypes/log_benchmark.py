@@ -0,0 +1,59 @@
+'''
+Measures CPU time spent on debug log calls filtered out by log level (INFO), comparing eager formatting
+("...{}".format(...)) with lazy arguments, callables and isEnabledFor guards.
+Run from src folder: python prototypes/log_benchmark.py [iterations]
+'''
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from opengnsys.log import logger, DEBUG  # @IgnorePep8
+
+ITERATIONS = 1000000
+
+
+def measure(name, fnc, iterations):
+    start = time.clock() if hasattr(time, 'clock') else time.process_time()
+    fnc(iterations)
+    elapsed = (time.clock() if hasattr(time, 'clock') else time.process_time()) - start
+    print('{:<12} {:8.3f} s CPU, {:8.3f} us per call'.format(name, elapsed, elapsed * 1000000 / iterations))
+    return elapsed
+
+
+def eager(iterations):
+    buf, msgLen = 10, 300
+    for _ in range(iterations):
+        logger.debug('Second length byte is {}, len is {}'.format(buf, msgLen))
+
+
+def lazy(iterations):
+    buf, msgLen = 10, 300
+    for _ in range(iterations):
+        logger.debug('Second length byte is %s, len is %s', buf, msgLen)
+
+
+def callable_(iterations):
+    buf, msgLen = 10, 300
+    for _ in range(iterations):
+        logger.debug(lambda: 'Second length byte is {}, len is {}'.format(buf, msgLen))
+
+
+def guarded(iterations):
+    buf, msgLen = 10, 300
+    for _ in range(iterations):
+        if logger.isEnabledFor(DEBUG):
+            logger.debug('Second length byte is {}, len is {}'.format(buf, msgLen))
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else ITERATIONS
+    logger.setLevel('INFO')
+    print('{} debug calls at INFO level'.format(iterations))
+    base = measure('format', eager, iterations)
+    for name, fnc in (('lazy args', lazy), ('callable', callable_), ('guarded', guarded)):
+        elapsed = measure(name, fnc, iterations)
+        print('{:<12} {:7.1f} % CPU saved'.format('', 100 * (base - elapsed) / base))
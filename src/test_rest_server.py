@@ -28,6 +28,13 @@
 
 '''
 @author: Adolfo Gómez, dkmaster at dkmon dot com
+
+Mock OpenGnsys server, for testing and benchmarking OGAgent without network.
+Implements ogagent REST methods (started, stopped, loggedin, loggedout, popup_done, error and events), with
+scriptable latency, error rate and outages, recording every request received.
+Example:
+    python test_rest_server.py --port 9999 --latency normal:0.05,0.01 --error-rate 0.1 --outage 30:60 --record r.json
+    python test_rest_server.py --check  # Checks routing, and agent failover, backoff and outbox replay against it
 '''
 # pylint: disable=unused-wildcard-import,wildcard-import
 from __future__ import unicode_literals, print_function
@@ -38,8 +45,13 @@ from six.moves.BaseHTTPServer import BaseHTTPRequestHandler  # @UnresolvedImport
 from six.moves.BaseHTTPServer import HTTPServer  # @UnresolvedImport
 from six.moves.urllib.parse import unquote  # @UnresolvedImport
 
+import argparse
+import collections
 import json
+import random
+import sys
 import threading
+import time
 import ssl
 
 import logging
@@ -116,95 +128,480 @@ xtvM
 
     return certFile
 
+BASE_PATH = 'opengnsys/rest/'  # REST base url path, methods are relative to it
+
+# Required data for every method, as checked by OpenGnsys server
+ROUTES = {
+    'ogagent/started': ('mac', 'ip', 'secret', 'ostype', 'osversion'),
+    'ogagent/stopped': ('mac', 'ip', 'ostype', 'osversion'),
+    'ogagent/loggedin': ('ip', 'user'),
+    'ogagent/loggedout': ('ip', 'user'),
+    'popup_done': (),
+    'error': (),
+    'ogagent/events': ('events',),
+}
+
+
+class Latency(object):
+    """
+    Response time distribution, described as "name:arg1,arg2...", in seconds:
+        none, fixed:value, uniform:min,max, normal:mean,stddev, exp:mean
+    """
+    def __init__(self, spec='none'):
+        self.spec = spec
+        name, _, args = spec.partition(':')
+        self.name = name
+        self.args = [float(v) for v in args.split(',')] if args else []
+        if name not in ('none', 'fixed', 'uniform', 'normal', 'exp'):
+            raise ValueError('Invalid latency distribution: {}'.format(spec))
+
+    def sample(self, rnd):
+        if self.name == 'fixed':
+            return self.args[0]
+        if self.name == 'uniform':
+            return rnd.uniform(self.args[0], self.args[1])
+        if self.name == 'normal':
+            return max(0.0, rnd.gauss(self.args[0], self.args[1]))
+        if self.name == 'exp':
+            return rnd.expovariate(1.0 / self.args[0])
+        return 0.0
+
+
+class Scenario(object):
+    """
+    Behaviour of mock server. Can be changed while running (i.e. scenario.down = True to simulate an outage)
+    @param latency: Latency instance (or its description)
+    @param errorRate: Probability of answering a request with "500 Internal Server Error"
+    @param outages: List of (start, end) periods, in seconds since server start, with connections closed unanswered
+    @param unsupported: Methods answered with "404 Not Found" (i.e. "ogagent/events", to test servers without bulk
+                        support)
+    @param seed: Random seed, so runs can be reproduced
+    """
+    def __init__(self, latency=None, errorRate=0.0, outages=None, unsupported=None, seed=None):
+        self.latency = latency if isinstance(latency, Latency) else Latency(latency or 'none')
+        self.errorRate = errorRate
+        self.outages = outages or []
+        self.unsupported = set(unsupported or [])
+        self.down = False
+        self.random = random.Random(seed)
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def isDown(self):
+        elapsed = time.time() - self.started
+        return self.down or any(start <= elapsed < end for start, end in self.outages)
+
+    def draw(self):
+        """
+        Returns (delay, failed) for a request. Draws are serialized, so a seeded run is reproducible
+        """
+        with self.lock:
+            return self.latency.sample(self.random), self.random.random() < self.errorRate
+
+
+class Recorder(object):
+    """
+    Keeps every request received by mock server
+    """
+    def __init__(self):
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def record(self, **kwargs):
+        kwargs['time'] = time.time()
+        with self.lock:
+            self.requests.append(kwargs)
+
+    def filter(self, route=None):
+        with self.lock:
+            return [r for r in self.requests if route is None or r['route'] == route]
+
+    def clear(self):
+        with self.lock:
+            del self.requests[:]
+
+    def summary(self):
+        """
+        Returns {route: {'count': ..., 'errors': ..., 'events': ...}}
+        """
+        res = collections.defaultdict(lambda: {'count': 0, 'errors': 0, 'events': 0})
+        for r in self.filter():
+            s = res[r['route']]
+            s['count'] += 1
+            s['errors'] += 1 if r['status'] != 200 else 0
+            s['events'] += len(r['data'].get('events', [])) if isinstance(r['data'], dict) else 0
+        return dict(res)
+
+    def save(self, fileName):
+        with open(fileName, 'w') as f:
+            json.dump(self.filter(), f, indent=1)
+
+
 class HTTPServerHandler(BaseHTTPRequestHandler):
     service = None
-    protocol_version = 'HTTP/1.0'
+    scenario = Scenario()
+    recorder = Recorder()
+    protocol_version = 'HTTP/1.1'  # Connections are kept alive, as real server does
+    timeout = 10  # Idle kept alive connections are closed, so server can be stopped
+    wbufsize = -1  # Responses are sent at once, so measured times are not distorted by Nagle's algorithm
+    disable_nagle_algorithm = True
     server_version = 'OpenGnsys Test REST Server'
     sys_version = ''
-    
+
     def sendJsonError(self, code, message):
-        self.send_response(code)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps({'error': message}))
-        return
+        self.sendJsonResponse({'error': message}, code)
 
-    def sendJsonResponse(self, data):
-        self.send_response(200)
-        data = json.dumps(data)
+    def sendJsonResponse(self, data, code=200):
+        self.send_response(code)
+        data = json.dumps(data).encode('utf-8')
         self.send_header('Content-type', 'application/json')
         self.send_header('Content-Length', len(data))
         self.end_headers()
         # Send the html message
         self.wfile.write(data)
-        
-    
+
     # parseURL
     def parseUrl(self):
         # Very simple path & params splitter
         path = self.path.split('?')[0][1:].split('/')
-        
+
         try:
             params = dict((v[0], unquote(v[1])) for v in (v.split('=') for v in self.path.split('?')[1].split('&')))
         except Exception:
             params = {}
-        
+
         return (path, params)
-    
 
-    def do_GET(self):
+    def getRoute(self):
+        '''
+        Returns method invoked (path relative to base url), or None if path is not under base url, or it is the
+        base url itself (used as health check)
+        '''
+        path = self.path.split('?')[0][1:]
+        if not path.startswith(BASE_PATH) or path == BASE_PATH:
+            return None
+        return path[len(BASE_PATH):]
+
+    def process(self, data):
         path, params = self.parseUrl()
-        
-        self.sendJsonResponse({'path': path, 'params': params})
-        
+        # Anything but methods under base url (i.e. base url, used as health check) is just echoed
+        route = self.getRoute()
+
+        if self.scenario.isDown():
+            self.close_connection = True  # Outage: connection is closed without response
+            self.recorder.record(route=route, method=self.command, path=path, params=params, data=data, status=0)
+            return
+
+        delay, failed = self.scenario.draw()
+        if delay:
+            time.sleep(delay)
+
+        if route is not None and (route not in ROUTES or route in self.scenario.unsupported):
+            status, response = 404, {'error': 'Method not found: {}'.format(route)}
+        elif failed:
+            status, response = 500, {'error': 'Injected error'}
+        elif route is not None and self.command == 'POST' and \
+                not all(k in (data if isinstance(data, dict) else {}) for k in ROUTES[route]):
+            status, response = 400, {'error': 'Missing parameters, required: {}'.format(', '.join(ROUTES[route]))}
+        else:
+            status, response = 200, {'path': path, 'params': params}
+
+        self.recorder.record(route=route, method=self.command, path=path, params=params, data=data, status=status,
+                             latency=delay)
+        self.sendJsonResponse(response, status)
+
+    def do_GET(self):
+        self.process(None)
+
     def do_POST(self):
-        path, getParams = self.parseUrl()
-        
         # Now post parameters, that are in JSON format
-        self.sendJsonResponse({'path': path, 'params': getParams})
+        length = int(self.headers.get('content-length', 0))
+        try:
+            data = json.loads(self.rfile.read(length).decode('utf-8'))
+        except Exception:
+            data = None
+        self.process(data)
 
     def log_error(self, fmt, *args):
         logger.error('HTTP ' + fmt % args)
-        
+
     def log_message(self, fmt, *args):
         logger.info('HTTP ' + fmt % args)
-        
+
 
 class HTTPThreadingServer(ThreadingMixIn, HTTPServer):
-    pass
+    daemon_threads = True
+
+    def __init__(self, address, handler):
+        HTTPServer.__init__(self, address, handler)
+        self.threads = []
+        self.threadsLock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        # As ThreadingMixIn, but keeping threads, so they can be joined on stop
+        t = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+        t.daemon = self.daemon_threads
+        with self.threadsLock:
+            self.threads = [thr for thr in self.threads if thr.is_alive()]
+            self.threads.append(t)
+        t.start()
+
+    def handle_error(self, request, client_address):
+        # Clients closing connections (or outages) are expected, so they are just logged
+        logger.debug('Error processing request from {}: {}'.format(client_address, sys.exc_info()[1]))
+
+    def joinThreads(self, timeout):
+        deadline = time.time() + timeout
+        with self.threadsLock:
+            threads = list(self.threads)
+        for t in threads:
+            t.join(max(deadline - time.time(), 0.01))
+
 
 class HTTPServerThread(threading.Thread):
-    def __init__(self, address, service):
+    def __init__(self, address, service, scenario=None, useSSL=True):
         super(self.__class__, self).__init__()
 
-        HTTPServerHandler.service = service
+        self.scenario = scenario or Scenario()
+        self.recorder = Recorder()
+        # Handler class of its own, so several servers can run at once (i.e. to test failover)
+        class Handler(HTTPServerHandler):
+            pass
+        Handler.service, Handler.scenario, Handler.recorder = service, self.scenario, self.recorder
+
+        self.server = HTTPThreadingServer(address, Handler)
+        self.useSSL = useSSL
+        if useSSL:
+            self.certFile = createSelfSignedCert()
+            self.server.socket = ssl.wrap_socket(self.server.socket, certfile=self.certFile, server_side=True)
 
-        self.certFile = createSelfSignedCert()
-        self.server = HTTPThreadingServer(address, HTTPServerHandler)
-        self.server.socket = ssl.wrap_socket(self.server.socket, certfile=self.certFile, server_side=True)
-        
-        logger.info('Initialized HTTPS Server thread on {}'.format(address))
+        logger.info('Initialized HTTP{} Server thread on {}'.format('S' if useSSL else '', address))
 
     def getServerUrl(self):
-        return 'https://{}:{}/{}'.format(self.server.server_address[0], self.server.server_address[1], HTTPServerHandler.uuid)
+        return '{}://{}:{}/{}'.format('https' if self.useSSL else 'http', self.server.server_address[0],
+                                      self.server.server_address[1], BASE_PATH)
 
-    def stop(self):
+    def stop(self, timeout=5):
         self.server.shutdown()
+        self.server.server_close()
+        self.server.joinThreads(timeout)
 
     def run(self):
         self.server.serve_forever()
 
-    
+
+def parseOutage(value):
+    start, end = value.split(':')
+    return float(start), float(end)
+
+
+def startServer(scenario=None):
+    thr = HTTPServerThread(('127.0.0.1', 0), None, scenario, useSSL=False)
+    thr.daemon = True
+    thr.start()
+    return thr
+
+
+def waitFor(condition, timeout):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def report(name, ok, details=''):
+    print('{} {}{}'.format('OK' if ok else 'FAIL', name, ': {}'.format(details) if details and not ok else ''))
+    return ok
+
+
+def isUnsupported(rest, method):
+    # On its own function, so raised error (and connection referenced by it) is freed on return
+    from opengnsys.RESTApi import UnsupportedError
+
+    try:
+        rest.sendMessage(method, {})
+        return False
+    except UnsupportedError:
+        return True
+
+
+def checkRouting():
+    '''
+    Sends every method (as agent does), checking that all of them are routed
+    '''
+    from opengnsys.RESTApi import REST
+
+    thr = startServer()
+    rest = REST(thr.getServerUrl())
+    ok = True
+    for route, required in sorted(ROUTES.items()):
+        method = route + '?id=1' if route == 'error' else route  # As agent sends errors
+        rest.sendMessage(method, dict((k, 'x') for k in required))
+        recorded = thr.recorder.filter(route)
+        ok = report(route, len(recorded) == 1 and recorded[0]['status'] == 200, recorded) and ok
+    ok = report('unknown methods are rejected', isUnsupported(rest, 'ogagent/nonexistent')) and ok
+    rest.close()
+    thr.stop()
+    return ok
+
+
+def checkFailover():
+    '''
+    With preferred server down, messages are sent to the other one, and preferred one is not tried again while the
+    other one is healthier
+    '''
+    from opengnsys import RESTApi
+
+    down, up = startServer(Scenario()), startServer()
+    down.scenario.down = True
+    rest = RESTApi.REST([down.getServerUrl(), up.getServerUrl()])
+    count = RESTApi.BREAKER_THRESHOLD + 2
+    for i in range(count):
+        rest.sendMessage('ogagent/loggedin', {'ip': 'x', 'user': 'user{}'.format(i)})
+    rest.close()
+    delivered = [r['data']['user'] for r in up.recorder.filter('ogagent/loggedin') if r['status'] == 200]
+    ok = report('failover to available server', delivered == ['user{}'.format(i) for i in range(count)], delivered)
+    tried = len(down.recorder.filter())
+    ok = report('server down is not tried again', tried == 1, '{} requests to server down'.format(tried)) and ok
+    down.stop()
+    up.stop()
+    return ok
+
+
+def checkBackoff():
+    '''
+    While server is down, notification is retried with exponential backoff, and it's delivered once server is back
+    '''
+    from opengnsys import RESTApi
+    from opengnsys.notifier import Notifier
+    from opengnsys.retry import RetryPolicy
+
+    class Backoff(RetryPolicy):
+        def getDelay(self, retry):  # No jitter, so delays can be checked
+            return min(self.cap, self.base * 2 ** (retry - 1))
+
+    policy = Backoff(base=0.2, cap=0.8)
+    thr = startServer()
+    thr.scenario.down = True
+    threshold, RESTApi.BREAKER_THRESHOLD = RESTApi.BREAKER_THRESHOLD, 1000  # Every retry must reach server
+    rest = RESTApi.REST(thr.getServerUrl())
+    notifier = Notifier(rest, retryPolicy=policy)
+    notifier.start()
+    try:
+        notifier.notify('ogagent/loggedin', {'ip': 'x', 'user': 'user'})
+        waitFor(lambda: len(thr.recorder.filter()) >= 6, 10)
+        thr.scenario.down = False
+        delivered = waitFor(lambda: thr.recorder.filter('ogagent/loggedin')[-1]['status'] == 200, 5)
+    finally:
+        notifier.stop(1)
+        rest.close()
+        RESTApi.BREAKER_THRESHOLD = threshold
+    times = [r['time'] for r in thr.recorder.filter()]
+    gaps = [b - a for a, b in zip(times, times[1:6])]
+    expected = [policy.getDelay(n) for n in range(1, len(gaps) + 1)]
+    ok = report('notifications retried with backoff', len(gaps) == 5 and
+                all(e * 0.9 <= g <= e + 0.3 for g, e in zip(gaps, expected)),
+                'gaps {}, expected {}'.format(['{:.2f}'.format(g) for g in gaps], expected))
+    ok = report('notification delivered once server is back', delivered and notifier.failures == 0 and
+                notifier.queued == 0, thr.recorder.summary()) and ok
+    thr.stop()
+    return ok
+
+
+def checkOutboxReplay():
+    '''
+    Durable notifications not delivered (server down) when agent stops, are sent on next run
+    '''
+    import os
+    import shutil
+    import tempfile
+    from opengnsys.RESTApi import REST
+    from opengnsys.notifier import Notifier
+    from opengnsys.outbox import Outbox
+    from opengnsys.retry import RetryPolicy
+
+    tmpDir = tempfile.mkdtemp()
+    path = os.path.join(tmpDir, 'outbox.journal')
+    thr = startServer()
+    thr.scenario.down = True
+    rest = REST(thr.getServerUrl())
+    try:
+        notifier = Notifier(rest, Outbox(path), retryPolicy=RetryPolicy(base=0.1, cap=0.2))
+        notifier.start()
+        notifier.notify('ogagent/loggedin', {'ip': 'x', 'user': 'user'}, key='session', durable=True)
+        notifier.notify('ogagent/loggedout', {'ip': 'x', 'user': 'user'}, key='session', durable=True)
+        waitFor(lambda: thr.recorder.filter(), 5)
+        notifier.stop(0.2)  # Server is still down, so they are kept on outbox
+        kept = [r['message'] for r in Outbox(path).items()]
+        ok = report('undelivered notifications kept on outbox', kept == ['ogagent/loggedin', 'ogagent/loggedout'],
+                    kept)
+
+        thr.scenario.down = False
+        thr.recorder.clear()
+        rest.close()
+        rest = REST(thr.getServerUrl())  # Next run
+        notifier = Notifier(rest, Outbox(path), retryPolicy=RetryPolicy(base=0.1, cap=0.2))
+        notifier.start()
+        waitFor(lambda: len(thr.recorder.filter()) >= 2, 5)
+        notifier.stop(1)
+        sent = [r['route'] for r in thr.recorder.filter() if r['status'] == 200]
+        ok = report('outbox replayed in order on next run', sent == ['ogagent/loggedin', 'ogagent/loggedout'],
+                    sent) and ok
+        left = Outbox(path).items()
+        ok = report('delivered notifications removed from outbox', not left, left) and ok
+    finally:
+        rest.close()
+        thr.stop()
+        shutil.rmtree(tmpDir)
+    return ok
+
+
+def check():
+    '''
+    Runs every check against mock servers, returning True if all of them pass
+    '''
+    results = [c() for c in (checkRouting, checkFailover, checkBackoff, checkOutboxReplay)]
+    return all(results)
+
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock OpenGnsys server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=9999)
+    parser.add_argument('--no-ssl', action='store_true', help='Use plain HTTP')
+    parser.add_argument('--latency', default='none', help='Response time distribution, i.e. uniform:0.01,0.2')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability of answering with an error')
+    parser.add_argument('--outage', type=parseOutage, action='append', default=[], metavar='START:END',
+                        help='Seconds since start without answering requests (can be repeated)')
+    parser.add_argument('--unsupported', action='append', default=[], metavar='METHOD',
+                        help='Method answered with "not found", i.e. ogagent/events (can be repeated)')
+    parser.add_argument('--seed', type=int, help='Random seed, for reproducible runs')
+    parser.add_argument('--record', help='File to save received requests on exit (JSON)')
+    parser.add_argument('--log', default='/tmp/restserver.log')
+    parser.add_argument('--check', action='store_true',
+                        help='Check routing, and agent failover, backoff and outbox replay, and exit')
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(0 if check() else 1)
+
     logging.basicConfig(
-        filename='/tmp/restserver.log',
+        filename=args.log,
         filemode='w',
         format='%(levelname)s %(asctime)s %(message)s',
         level=logging.DEBUG
     )
-    
-    thr = HTTPServerThread(('0.0.0.0', 9999), None)
-    print('Server started: {}'.format(thr))
-    thr.run()
-    
\ No newline at end of file
+
+    thr = HTTPServerThread((args.host, args.port), None,
+                           Scenario(args.latency, args.error_rate, args.outage, args.unsupported, args.seed),
+                           useSSL=not args.no_ssl)
+    print('Server started: {}'.format(thr.getServerUrl()))
+    try:
+        thr.run()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(thr.recorder.summary(), indent=1, sort_keys=True))
+    if args.record:
+        thr.recorder.save(args.record)